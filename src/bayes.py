@@ -1,7 +1,20 @@
 """ Bayes Network module
 """
 
+from contextlib import contextmanager
+import json
+import os
+import re
+import struct
+import tempfile
+
+import numpy
+
 from errors import *
+from factor import Factor
+
+# Tokens of the input file are separated by whitespace
+TOKEN = re.compile(r"\S+")
 
 
 class Variable(object):
@@ -10,12 +23,22 @@ class Variable(object):
     Attributes:
         name(str): Name of the variable.
         values(str): Possible values in lowercase
+        index(dict): Integer code of each value, its position in values
         alias: Optional name that can be used to refer to the variable
         parents: Parents of the node
         children: children of the node
+        cpt: The CPT as one flat float array, each line being at the \
+            position given by the codes of its values
+        factor: The CPT as a factor, left untouched by the queries
+        mapped: The file, offset and shape of the CPT when it is mapped \
+            from a file, None otherwise
 
     """
 
+    # no per instance dictionary, large networks have many nodes
+    __slots__ = ("name", "values", "index", "alias", "parents", "children",
+                 "table_header", "cpt", "factor", "mapped", "_parents")
+
     def __init__(self, data={}):
         if not data:
             self.parents = {
@@ -24,7 +47,6 @@ class Variable(object):
             }
 
             self.table_header = []
-            self.table = []
             return
 
         if "name" not in data or "values" not in data:
@@ -32,6 +54,7 @@ class Variable(object):
 
         self.name = data["name"]
         self.values = [a.lower() for a in data["values"]]
+        self.index = dict((value, i) for (i, value) in enumerate(self.values))
 
         if "alias" in data:
             self.alias = data["alias"]
@@ -69,35 +92,87 @@ class Variable(object):
 
         del(self._parents)
 
-    def populate_cpt(self, table):
+    def populate_cpt(self, table, values=None, mapped=None):
         """ Populates the CPT based of the string read from the file
 
         Arguments:
             table: The CPT
+            values: Optional flat array where the CPT is written to, such \
+                as a view of a mapped file
+            mapped: The file, offset and shape of values, if it is mapped \
+                from a file
         """
 
-        cols = len(self.parents["list"]) + 2
-        lines = len(table) / cols
+        reader = CPTReader()
+        reader.start([var.values for var in [self] + self.parents["list"]],
+                     values)
+        reader.feed(list(table))
+        reader.finish()
 
-        if int(lines) != lines:
-            raise BNMalformedTable
+        self.set_cpt(reader.values, mapped)
 
-        # check if number of lines is correct
-        l = len(self.values)
-        for parent in self.parents["list"]:
-            l *= len(parent.values)
+    def set_cpt(self, values, mapped=None):
+        """ Sets the CPT from an array, without going through the lines
 
-        if l != lines:
-            raise BNMalformedTable
+        Arguments:
+            values: Flat array with the CPT, the codes of the variable and \
+                of each parent being the digits of the position of a line
+            mapped: The file, offset and shape of values, if it is mapped \
+                from a file
+        """
 
         self.table_header = [self] + self.parents["list"]
-        self.table = []
-        for n in range(l):
-            line = table[n*cols:(n+1)*cols]
+        self.mapped = mapped
+
+        # the factor is a view of the CPT shared by every query, so neither
+        #must be changed
+        self.cpt = numpy.asarray(values, dtype=float).reshape(-1)
+        self.cpt.flags.writeable = False
+        self.factor = Factor(self.table_header, self.cpt.reshape(
+            [len(var.values) for var in self.table_header]))
+
+    def __getstate__(self):
+        """ Gets the attributes to pickle, leaving out the factor, which is \
+            a view of the CPT, and a CPT mapped from a file, so other \
+            processes map the file instead of getting a copy
+        """
 
-            values = [a.lower() for a in line[:-1]]
-            values.append(float(line[-1]))
-            self.table.append(values)
+        state = {}
+        for slot in self.__slots__:
+            if hasattr(self, slot):
+                state[slot] = getattr(self, slot)
+
+        # the CPT is pickled with the shape of the factor, which the parents
+        #may not have yet when it is unpickled
+        if "factor" in state:
+            del state["factor"]
+            if state["mapped"]:
+                del state["cpt"]
+            else:
+                state["cpt"] = self.factor.values
+
+        return state
+
+    def __setstate__(self, state):
+        """ Sets the pickled attributes, mapping the CPT from its file if \
+            it was left out, and making the factor a view of the CPT again
+        """
+
+        for slot in state:
+            setattr(self, slot, state[slot])
+
+        if state.get("mapped"):
+            (filename, offset, shape) = self.mapped
+            values = numpy.memmap(filename, dtype="<f8", mode='r',
+                                  offset=offset, shape=tuple(shape))
+        elif "cpt" in state:
+            values = state["cpt"]
+            values.flags.writeable = False
+        else:
+            return
+
+        self.cpt = values.reshape(-1)
+        self.factor = Factor(self.table_header, values)
 
     def names(self):
         """ Get all the names which this variable can have
@@ -113,11 +188,177 @@ class Variable(object):
         return names
 
 
+class CPTReader(object):
+    """ Fills the flat array of a CPT as the lines of its table arrive
+
+    Attributes:
+        line: Line of the file where the CPT is defined.
+        index: What each value of the variable and of each parent adds to \
+            the position of a line in the flat array, its code times the \
+            stride of the variable, None until they are known.
+        shape: Number of values of the variable and of each parent.
+        size: Number of lines of the table.
+        values: The flat array with the CPT, filled in once every line is \
+            read.
+        probabilities: The probability of each line, None until it is read.
+        offset: Position of the CPT in the storage file, once written there.
+        lines: Number of lines already read.
+        row: Tokens of a line of the table split across lines of the file.
+        sources: Number and text of each line of the file with tokens in \
+            row, the position in row of its first token and the position \
+            of that token in the line.
+        tokens: Lines read before the variables of the table were known.
+    """
+
+    def __init__(self, line=None):
+        self.line = line
+        self.index = None
+        self.values = None
+        self.offset = None
+        self.lines = 0
+        self.row = []
+        self.sources = []
+        self.tokens = []
+
+    def start(self, header, values=None):
+        """ Sets the variables of the table, reading the tokens that were \
+            waiting for them
+
+        Arguments:
+            header: The values of the variable followed by the ones of \
+                each parent
+            values: Optional flat array where the CPT is written to
+        """
+
+        self.shape = [len(var) for var in header]
+        self.size = int(numpy.prod(self.shape))
+
+        # position in the flat array of each line, the codes of the values
+        #being its digits
+        strides = [1 for var in header]
+        for i in reversed(range(len(header) - 1)):
+            strides[i] = strides[i + 1] * self.shape[i + 1]
+
+        self.index = [dict((value.lower(), i * stride)
+                           for (i, value) in enumerate(var))
+                      for (var, stride) in zip(header, strides)]
+
+        if values is None:
+            values = numpy.zeros(self.size)
+        self.values = values
+        self.probabilities = [None] * self.size
+
+        tokens = self.tokens
+        self.tokens = None
+        for line in tokens:
+            self.feed(*line)
+
+    def feed(self, tokens, line=None, text=None, skip=0):
+        """ Reads the tokens of a line of the file
+
+        Arguments:
+            tokens: The tokens of the line
+            line: Number of the line in the file
+            text: The line, to find the column of a token when it is wrong
+            skip: Number of tokens of the line before the table
+        """
+
+        if self.index is None:
+            self.tokens.append((tokens, line, text, skip))
+            return
+
+        width = len(self.index) + 1
+
+        # a line of the table usually is a line of the file
+        if not self.row and len(tokens) - skip == width:
+            self.read_row(tokens, skip, [(line, text, 0, 0)])
+            return
+
+        self.sources.append((line, text, len(self.row), skip))
+        self.row.extend(tokens[skip:])
+
+        start = 0
+        while len(self.row) - start >= width:
+            self.read_row(self.row, start, self.sources)
+            start += width
+
+        # only the lines with tokens left are kept
+        self.row = self.row[start:]
+        self.sources = [(number, text, first - start, position)
+                        for (number, text, first, position) in self.sources]
+        while len(self.sources) > 1 and self.sources[1][2] <= 0:
+            self.sources.pop(0)
+        if not self.row:
+            self.sources = []
+
+    def read_row(self, row, start, sources):
+        """ Reads a line of the table
+
+        Arguments:
+            row: The tokens
+            start: Position of the first token of the line in row
+            sources: The sources of the tokens of row
+        """
+
+        position = 0
+        for (i, steps) in enumerate(self.index, start):
+            step = steps.get(row[i].lower())
+            if step is None:
+                raise CPTReader.error(sources, i)
+            position += step
+
+        # every line of the table is given once
+        if self.probabilities[position] is not None:
+            raise CPTReader.error(sources, start)
+
+        end = start + len(self.index)
+        try:
+            self.probabilities[position] = float(row[end])
+        except ValueError:
+            raise CPTReader.error(sources, end)
+
+        self.lines += 1
+
+    @staticmethod
+    def error(sources, k):
+        """ Builds the error of a wrong token of a line of the table
+
+        Arguments:
+            sources: Number and text of each line of the file with tokens \
+                in the row, the position in the row of its first token and \
+                the position of that token in the line
+            k: Position of the wrong token in the row
+
+        Returns:
+            The BNMalformedTable with the line and column of the token
+        """
+
+        (number, text, first, position) = [source for source in sources
+                                           if source[2] <= k][-1]
+        if number is None:
+            return BNMalformedTable()
+
+        return BNMalformedTable(number,
+                                TokenColumn(text, k - first + position))
+
+    def finish(self):
+        """ Checks that the table has all its lines
+        """
+
+        if self.row or self.lines != self.size:
+            raise BNMalformedTable(self.line)
+
+        self.values[:] = self.probabilities
+        self.probabilities = None
+
+
 class BayesN(object):
     """ Represents a Bayesian Network
 
     Attributes:
         filename(str): Bayesian Network input file.
+        storage(str): Optional file where the CPTs are written to and \
+            mapped from, instead of being kept in memory.
         nodes(dict): Nodes of the BN in both list and dict format for
             unique and easy access by name respectively.
     """
@@ -145,17 +386,31 @@ class BayesN(object):
         }
     }
 
-    def __init__(self, filename):
+    # Compiled networks start with this string, followed by the length of
+    #the JSON header, the header itself and the CPTs as float64 arrays
+    COMPILED_MAGIC = b"BNC1"
+    COMPILED_EXT = ".bnc"
+
+    def __init__(self, filename, storage=None):
 
         self.filename = filename
+        self.storage = storage
         self.nodes = None
 
+        if self.filename.endswith(self.COMPILED_EXT):
+            self.load_compiled()
+            return
+
         CheckExtension(self.filename)
 
-        data = self.parse_file(filename)
+        if self.storage:
+            with ReplacingFile(self.storage) as storage:
+                (variables, cpts) = self.parse_file(filename, storage)
+        else:
+            (variables, cpts) = self.parse_file(filename)
 
-        self.populate_vars(data["VAR"])
-        self.populate_cpts(data["CPT"])
+        self.populate_vars(variables)
+        self.populate_cpts(cpts)
 
     def populate_vars(self, variables):
         """ Creates all the variables as objects, and converts the parents \
@@ -187,128 +442,339 @@ class BayesN(object):
             node.convert_parents(self.nodes["dict"])
 
     def populate_cpts(self, cpts):
-        """ Creates all the CPTs as objects, and converts the variable names \
-            stings into references
+        """ Sets the CPTs read from the file on the variables
 
         Arguments:
-            cpts: All the tables as described in the input file.
+            cpts: The CPTReader with the table of each variable name.
         """
 
-        for cpt in cpts:
-            if "var" in cpt and "table" in cpt:
-                self.nodes["dict"][cpt["var"]].populate_cpt(cpt["table"])
+        if self.storage and cpts:
+            data = numpy.memmap(self.storage, dtype="<f8", mode='r')
+
+        for name in cpts:
+            node = self.nodes["dict"][name]
+            table = cpts[name]
+
+            if table.offset is None:
+                node.set_cpt(table.values)
             else:
+                start = table.offset // 8
+                node.set_cpt(data[start:start + table.size],
+                             (self.storage, table.offset, table.shape))
+
+    def compile(self, filename):
+        """ Writes the network in the compiled format, which is loaded \
+            without parsing and with the CPTs mapped from the file
+
+        Arguments:
+            filename: The name of the compiled file
+        """
+
+        header = {"variables": []}
+        for node in self.nodes["list"]:
+            if not hasattr(node, "factor"):
                 raise BNIncompleteEntry
 
-    def parse_file(self, filename):
-        """ Parses an input file
+            variable = {
+                "name": node.name,
+                "values": node.values,
+                "parents": [parent.name for parent in node.parents["list"]]
+            }
+            if node.alias:
+                variable["alias"] = node.alias
+            header["variables"].append(variable)
+
+        header = json.dumps(header).encode()
+
+        with ReplacingFile(filename) as out_file:
+            out_file.write(self.COMPILED_MAGIC)
+            out_file.write(struct.pack("<Q", len(header)))
+            out_file.write(header)
+
+            # the arrays start aligned to 8 bytes
+            out_file.write(b" " * (-out_file.tell() % 8))
+
+            for node in self.nodes["list"]:
+                out_file.write(numpy.ascontiguousarray(
+                    node.factor.values, dtype="<f8").tobytes())
+
+    def load_compiled(self):
+        """ Loads a compiled network, the CPTs being views of the file
+        """
+
+        bnfile = open(self.filename, 'rb')
+
+        if bnfile.read(len(self.COMPILED_MAGIC)) != self.COMPILED_MAGIC:
+            raise BNFileError(999)
+
+        (length,) = struct.unpack("<Q", bnfile.read(8))
+        header = json.loads(bnfile.read(length).decode())
+        offset = bnfile.tell() + (-bnfile.tell() % 8)
+        bnfile.close()
+
+        self.populate_vars(header["variables"])
+
+        data = numpy.memmap(self.filename, dtype="<f8", mode='r',
+                            offset=offset)
+
+        start = 0
+        for node in self.nodes["list"]:
+            shape = [len(var.values) for var in [node] + node.parents["list"]]
+            size = int(numpy.prod(shape))
+            if start + size > len(data):
+                raise BNFileError(999)
+
+            node.set_cpt(data[start:start + size],
+                         (self.filename, offset + 8 * start, shape))
+            start += size
+
+    def parse_file(self, filename, storage=None):
+        """ Parses an input file in a single pass, filling the CPTs as the \
+            tokens of their tables are read
 
         Arguments:
             filename: The name of the file to be parsed.
+            storage: Optional open file where the CPTs are written to as \
+                soon as they are read
+
+        Returns:
+            The VAR entries and the CPTReader with the table of each \
+            variable name
         """
 
         # Opens input file and starts parsing it
         bnfile = open(self.filename, 'r')
 
-        current = {
-        }
-
-        data = {
-            "VAR": [],
-            "CPT": []
+        parsed = {
+            "variables": [],
+            # VAR entry of each name and alias
+            "names": {},
+            "cpts": {},
+            # CPTs whose variables are only defined after them
+            "waiting": [],
+            "storage": storage
         }
 
-        line = bnfile.readline()
+        current = None
+        table = None
 
-        while line:
-            elements = line.split()
+        for (number, line) in enumerate(bnfile, 1):
+            tokens = line.split()
 
             # Ignore comment lines and blank lines
-            if line[0] == '#' or not elements:
-                line = bnfile.readline()
+            if line[0] == '#' or not tokens:
                 continue
 
+            field = tokens[0]
+
             # beginning of a new entry
-            elif len(elements) == 1 and elements[0] in self.ENTRY_TYPES:
-                # save the previous entry
-                if current:
-                    data[current["type"]].append(current["data"])
+            if len(tokens) == 1 and field in self.ENTRY_TYPES:
+                self.end_entry(current, parsed)
 
-                # create a new empty entry
                 current = {
-                    "type": elements[0],
-                    "data": {}
+                    "type": field,
+                    "data": {},
+                    "line": number
                 }
-                line = bnfile.readline()
+                table = None
                 continue
 
-            # check for duplicated fields
-            elif elements[0] in current["data"]:
-                raise BNDuplicatedField
+            elif current is None:
+                raise BNUnknownFieldType(number, TokenColumn(line, 0))
 
-            # check if the field is a valid one
             valid_fields = self.ENTRY_TYPES[current["type"]]["valid-fields"]
 
-            if elements[0] in valid_fields:
-                field_type = valid_fields[elements[0]]
+            # the table goes on until another field or entry comes up
+            if table is not None and field not in valid_fields:
+                table.feed(tokens, number, line)
+                continue
+
+            table = None
+
+            # check for duplicated fields
+            if field in current["data"]:
+                raise BNDuplicatedField(number, TokenColumn(line, 0))
+
+            # fields that are not valid are ignored
+            if field not in valid_fields:
+                continue
+
+            field_type = valid_fields[field]
+
+            if field_type == "single":
+                if len(tokens) != 2:
+                    raise BNWrongNumberArguments(number, TokenColumn(line, 0))
+
+                current["data"][field] = tokens[1]
+
+            elif field_type == "multiple":
+                if len(tokens) < 2:
+                    raise BNWrongNumberArguments(number, TokenColumn(line, 0))
+
+                current["data"][field] = tokens[1:]
+
+            elif field_type == "multiple-lines":
+                table = CPTReader(current["line"])
+                current["data"][field] = table
+
+            else:
+                raise BNUnknownFieldType(number, TokenColumn(line, 0))
+
+            if current["type"] == "CPT":
+                self.start_table(current, parsed["names"])
+
+            if table is not None:
+                table.feed(tokens, number, line, 1)
 
-                if field_type == "single":
-                    if len(elements) != 2:
-                        raise BNWrongNumberArguments
+        self.end_entry(current, parsed)
+        bnfile.close()
 
-                    current["data"][elements[0]] = elements[1]
+        for entry in parsed["waiting"]:
+            if not self.start_table(entry, parsed["names"]):
+                raise BNIncompleteEntry(entry["line"])
+            self.end_table(entry, parsed)
 
-                elif field_type == "multiple":
-                    if len(elements) < 2:
-                        raise BNWrongNumberArguments
+        return (parsed["variables"], parsed["cpts"])
 
-                    current["data"][elements[0]] = elements[1:]
+    def end_entry(self, entry, parsed):
+        """ Keeps an entry once all its fields are read
 
-                elif field_type == "multiple-lines":
-                    new_data = []
-                    tag = elements[0]
+        Arguments:
+            entry: The entry, None if there is none
+            parsed: What was parsed from the file so far
+        """
+
+        if entry is None:
+            return
+
+        data = entry["data"]
+
+        if entry["type"] == "VAR":
+            if "name" not in data or "values" not in data:
+                raise BNIncompleteEntry(entry["line"])
+
+            parsed["variables"].append(data)
+
+            names = [data["name"]]
+            if "alias" in data:
+                names.append(data["alias"])
+            for name in names:
+                # check for name/alias clashes
+                if name in parsed["names"]:
+                    raise BNDuplicatedNameOrAlias(entry["line"])
+                parsed["names"][name] = data
+
+        elif entry["type"] == "CPT":
+            if "var" not in data or "table" not in data:
+                raise BNIncompleteEntry(entry["line"])
+
+            if self.start_table(entry, parsed["names"]):
+                self.end_table(entry, parsed)
+            else:
+                parsed["waiting"].append(entry)
+
+    def start_table(self, entry, names):
+        """ Starts filling the table of a CPT entry if its variable and the \
+            parents are already defined
+
+        Arguments:
+            entry: The CPT entry
+            names: The VAR entry of each name and alias
+
+        Returns:
+            Whether the table was started
+        """
 
-                    if len(elements) > 1:
-                        new_data += elements[1:]
+        data = entry["data"]
+        if "var" not in data or "table" not in data:
+            return False
 
-                    line = bnfile.readline()
-                    while line:
-                        mul_elements = line.split()
+        if data["table"].index is not None:
+            return True
 
-                        # Ignore comment lines and blank lines
-                        if line[0] == '#' or not mul_elements:
-                            line = bnfile.readline()
-                            continue
+        if data["var"] not in names:
+            return False
 
-                        # beginning of a new entry
-                        elif (len(mul_elements) == 1 and
-                              mul_elements[0] in self.ENTRY_TYPES):
-                            # break and let the outer loop take care of the
-                            #line
-                            break
+        variable = names[data["var"]]
+        header = [variable]
+        for parent in variable.get("parents", []):
+            if parent not in names:
+                return False
+            header.append(names[parent])
 
-                        # check if another field of the same entry has come up
-                        elif line[0] in valid_fields:
-                            # break and let the outer loop take care of the
-                            #line
-                            break
-                        else:
-                            new_data += mul_elements
+        data["table"].start([var["values"] for var in header])
 
-                        line = bnfile.readline()
+        return True
 
-                    current["data"][tag] = new_data
-                    continue
+    def end_table(self, entry, parsed):
+        """ Keeps the table of a CPT entry once all its lines are read
 
-                else:
-                    raise BNUnknownFieldType
+        Arguments:
+            entry: The CPT entry
+            parsed: What was parsed from the file so far
+        """
+
+        table = entry["data"]["table"]
+        table.finish()
+
+        name = parsed["names"][entry["data"]["var"]]["name"]
+        if name in parsed["cpts"]:
+            raise BNDuplicatedEntry(entry["line"])
+
+        if parsed["storage"]:
+            table.offset = parsed["storage"].tell()
+            parsed["storage"].write(numpy.ascontiguousarray(
+                table.values, dtype="<f8").tobytes())
+            table.values = None
 
-            line = bnfile.readline()
+        parsed["cpts"][name] = table
 
-        if current:
-            data[current["type"]].append(current["data"])
 
-        return data
+@contextmanager
+def ReplacingFile(filename):
+    """ Opens a new file in the directory of the given one, which takes its \
+        place once written, so the processes that mapped the old file keep \
+        reading it instead of seeing it truncated
+
+    Arguments:
+        filename: The file to write
+
+    Returns:
+        The new file, opened for writing bytes
+    """
+
+    (descriptor, temporary) = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(filename)))
+
+    # the new file gets the permissions open would have given it
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(temporary, 0o666 & ~umask)
+
+    try:
+        with os.fdopen(descriptor, 'wb') as out_file:
+            yield out_file
+        os.replace(temporary, filename)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def TokenColumn(line, k):
+    """ Finds the column of a token of a line, which is only needed to \
+        report an error
+
+    Arguments:
+        line: The line
+        k: Position of the token among the tokens of the line
+
+    Returns:
+        The column of the token, counting from 1
+    """
+
+    for (i, match) in enumerate(TOKEN.finditer(line)):
+        if i == k:
+            return match.start() + 1
 
 
 def CheckExtension(filename):
@@ -0,0 +1,5 @@
+""" Benchmarks of the inference algorithms on synthetic networks
+
+Run from the src directory with python -m bench, the results being written
+as JSON so they can be compared between versions.
+"""
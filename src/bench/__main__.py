@@ -0,0 +1,86 @@
+""" Command line of the benchmarks, run with python -m bench
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+from bench.generate import random_network, write_network, write_queries
+from bench.timing import benchmark
+from ordering import ORDERINGS
+from run import ArgParser
+
+
+def main():
+    """ Main function of the benchmark.
+
+    Generates a random network and queries for each number of nodes, times
+    them and writes the results as JSON.
+    """
+
+    parser = ArgParser(description="", epilog="")
+    parser.add_argument("-n", "--nodes", type=int, nargs="+", default=[20],
+                        help="number of nodes of each network")
+    parser.add_argument("--in-degree", type=int, default=2,
+                        help="maximum number of parents of a node")
+    parser.add_argument("--min-values", type=int, default=2,
+                        help="minimum number of values of a node")
+    parser.add_argument("--max-values", type=int, default=3,
+                        help="maximum number of values of a node")
+    parser.add_argument("-w", "--width", type=int, default=4,
+                        help="number of previous nodes among which the \
+                            parents are drawn, which bounds the treewidth")
+    parser.add_argument("-q", "--queries", type=int, default=10,
+                        help="number of queries on each network")
+    parser.add_argument("-e", "--evidence", type=int, default=2,
+                        help="maximum number of evidence variables of a \
+                            query")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="number of runs, the best one being kept")
+    parser.add_argument("-s", "--seed", type=int, default=0,
+                        help="seed of the random networks and queries")
+    parser.add_argument("-o", "--order", default="topological",
+                        choices=["topological"] + sorted(ORDERINGS),
+                        help="order in which the hidden variables are \
+                            eliminated")
+    parser.add_argument("--output",
+                        help="file where the results are written to \
+                            (instead of the console)")
+
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for nodes in args.nodes:
+            network = random_network(nodes, args.in_degree,
+                                     (args.min_values, args.max_values),
+                                     args.width, args.seed)
+            bn_file = os.path.join(directory, "net{}.bn".format(nodes))
+            qe_file = os.path.join(directory, "net{}.in".format(nodes))
+            write_network(bn_file, network)
+            write_queries(qe_file, network, args.queries, args.evidence,
+                          args.seed)
+
+            result = {
+                "nodes": nodes,
+                "in_degree": args.in_degree,
+                "values": [args.min_values, args.max_values],
+                "width": args.width,
+                "order": args.order,
+                "seed": args.seed
+            }
+            result.update(benchmark(bn_file, qe_file, args.repeat,
+                                    ORDERINGS.get(args.order)))
+            results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as out_file:
+            json.dump(results, out_file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == '__main__':
+    main()
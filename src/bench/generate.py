@@ -0,0 +1,103 @@
+""" Random networks and queries in the .bn and .in formats
+"""
+
+import itertools
+import random
+
+
+def random_network(nodes, in_degree=2, cardinality=(2, 3), width=4,
+                   seed=0):
+    """ Builds a random DAG with a random CPT for each node
+
+    The parents of each node are drawn from the width nodes before it, so
+    the treewidth of the network is at most width.
+
+    Arguments:
+        nodes: Number of nodes
+        in_degree: Maximum number of parents of a node
+        cardinality: Minimum and maximum number of values of a node
+        width: Number of previous nodes among which the parents are drawn
+        seed: Seed of the random generator
+
+    Returns:
+        A list with the name, values, parents and CPT lines of each node, \
+        parents before children
+    """
+
+    rnd = random.Random(seed)
+    network = []
+
+    for i in range(nodes):
+        name = "V{}".format(i)
+        values = ["v{}".format(k) for k in
+                  range(rnd.randint(cardinality[0], cardinality[1]))]
+
+        candidates = network[max(0, i - width):]
+        parents = rnd.sample(candidates,
+                             rnd.randint(0, min(in_degree, len(candidates))))
+
+        # one distribution over the values for each line of the parents
+        lines = []
+        for combination in itertools.product(
+                *[parent[1] for parent in parents]):
+            weights = [rnd.random() for value in values]
+            for (value, weight) in zip(values, weights):
+                lines.append([value] + list(combination) +
+                             [weight / sum(weights)])
+
+        network.append((name, values, [parent[0] for parent in parents],
+                        lines))
+
+    return network
+
+
+def write_network(filename, network):
+    """ Writes a network in the .bn format
+
+    Arguments:
+        filename: The .bn file
+        network: The network, as given by random_network
+    """
+
+    with open(filename, 'w') as bn_file:
+        bn_file.write("# Variable specification\n")
+        for (name, values, parents, lines) in network:
+            bn_file.write("VAR\nname {}\n".format(name))
+            if parents:
+                bn_file.write("parents {}\n".format(" ".join(parents)))
+            bn_file.write("values {}\n\n".format(" ".join(values)))
+
+        bn_file.write("# CPT specification\n")
+        for (name, values, parents, lines) in network:
+            bn_file.write("CPT\nvar {}\ntable\n".format(name))
+            for line in lines:
+                bn_file.write("{} {!r}\n".format(" ".join(line[:-1]),
+                                                 line[-1]))
+            bn_file.write("\n")
+
+
+def write_queries(filename, network, queries=10, evidence=2, seed=0):
+    """ Writes random queries on a network in the .in format, one QUERY \
+        and EVIDENCE pair per query
+
+    Arguments:
+        filename: The .in file
+        network: The network, as given by random_network
+        queries: Number of queries
+        evidence: Maximum number of evidence variables of a query
+        seed: Seed of the random generator
+    """
+
+    rnd = random.Random(seed)
+
+    with open(filename, 'w') as qe_file:
+        for i in range(queries):
+            chosen = rnd.sample(network, min(len(network), evidence + 1))
+            qe_file.write("QUERY {}\n".format(chosen[0][0]))
+
+            observed = chosen[1:rnd.randint(1, len(chosen))]
+            if observed:
+                pairs = ["{} {}".format(name, rnd.choice(values))
+                         for (name, values, parents, lines) in observed]
+                qe_file.write("EVIDENCE {} {}\n".format(len(observed),
+                                                       " ".join(pairs)))
@@ -0,0 +1,67 @@
+""" Timing of each phase of the VE algorithm
+"""
+
+import time
+
+from bayes import BayesN
+from qe import QandEBatch
+from stats import Stats
+from ve import VE
+
+
+def benchmark(bn_file, qe_file, repeat=3, ordering=None):
+    """ Times the parse of a network and the queries of a file, keeping \
+        the best of several runs
+
+    The phases are timed with the product of the factors of each hidden
+    variable built before summing it out, as when logging each step; the
+    total is the time taken by the queries as run.py answers them.
+
+    Arguments:
+        bn_file: The .bn file
+        qe_file: The .in file, with one or more queries
+        repeat: Number of runs
+        ordering: Optional elimination ordering heuristic
+
+    Returns:
+        A dictionary with the times, in seconds
+    """
+
+    parse = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        bn = BayesN(bn_file)
+        parse.append(time.perf_counter() - start)
+
+    queries = QandEBatch(qe_file).queries
+
+    runs = []
+    for i in range(repeat):
+        stats = Stats()
+        for qe in queries:
+            VE(bn.nodes, qe, True, ordering, stats=stats)
+        runs.append(stats)
+
+    total = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        VE.batch(bn.nodes, queries, False, ordering)
+        total.append(time.perf_counter() - start)
+
+    phases = {}
+    for phase in runs[0].seconds:
+        best = min(runs, key=lambda stats: stats.seconds[phase])
+        phases[phase] = {
+            "seconds": best.seconds[phase],
+            "calls": best.calls[phase]
+        }
+
+    return {
+        "queries": len(queries),
+        "parse": min(parse),
+        "phases": phases,
+        "peak_rows": runs[0].peak_rows,
+        "peak_width": runs[0].peak_width,
+        "comparisons": runs[0].comparisons,
+        "total": min(total)
+    }
@@ -0,0 +1,242 @@
+""" Cache of query results
+"""
+
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import sys
+
+from factor import Factor
+
+
+class ResultCache(object):
+    """ Least recently used cache of the results of the queries on one \
+        network
+
+    Attributes:
+        fingerprint(str): Hash of the contents of the network file.
+        size(int): Maximum number of results kept.
+        filename(str): Optional file where the cache is kept between runs.
+        entries: The results, from the least to the most recently used.
+    """
+
+    def __init__(self, fingerprint, size=1024, filename=None):
+        self.fingerprint = fingerprint
+        self.size = size
+        self.filename = filename
+        self.entries = OrderedDict()
+
+        if filename and os.path.exists(filename):
+            self.load()
+
+    @staticmethod
+    def key(bn, qe):
+        """ Builds the key of a query, with the aliases replaced by the \
+            names and the evidence in a fixed order
+
+        Arguments:
+            bn: Belief network
+            qe: The QandE object with the query
+
+        Returns:
+            The key of the query
+        """
+
+        evidence = []
+        for name in qe.evidence:
+            evidence.append((bn["dict"][name].name, qe.evidence[name]))
+
+        query = tuple(bn["dict"][name].name for name in qe.query)
+
+        return (query, tuple(sorted(evidence)))
+
+    def get(self, bn, key):
+        """ Gets a result from the cache
+
+        Arguments:
+            bn: Belief network
+            key: The key of the query
+
+        Returns:
+            The factor with the result, or None if it is not in the cache
+        """
+
+        if key not in self.entries:
+            return None
+
+        self.entries.move_to_end(key)
+        (names, values) = self.entries[key]
+
+        return Factor([bn["dict"][name] for name in names], values)
+
+    def put(self, key, result):
+        """ Adds a result to the cache, dropping the least recently used \
+            one if the cache is full
+
+        Arguments:
+            key: The key of the query
+            result: The factor with the result
+        """
+
+        if self.size < 1:
+            return
+
+        self.entries[key] = ([var.name for var in result.table_header],
+                             result.values)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def load(self):
+        """ Loads the cache from its file, unless it belongs to a network \
+            with different contents
+        """
+
+        with open(self.filename, 'rb') as cache_file:
+            data = pickle.load(cache_file)
+
+        if data["fingerprint"] != self.fingerprint:
+            return
+
+        for (key, entry) in data["entries"]:
+            self.entries[key] = entry
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        """ Writes the cache to its file
+        """
+
+        data = {
+            "fingerprint": self.fingerprint,
+            "entries": list(self.entries.items())
+        }
+
+        with open(self.filename, 'wb') as cache_file:
+            pickle.dump(data, cache_file)
+
+
+class FactorCache(object):
+    """ Least recently used cache of the factors made by summing out \
+        hidden variables, and of the numbers standing for their keys, \
+        bounded by the memory taken by both
+
+    A key dropped from the cache gets another number when it comes back,
+    so the keys made from its old number are never found again and go
+    away in turn.
+
+    Attributes:
+        budget(int): Maximum number of bytes taken by the keys and factors.
+        used(int): Number of bytes taken by the keys and factors.
+        entries: The number of each key and its factor, None when it only \
+            has a number, from the least to the most recently used.
+        count(int): Number of numbers given so far.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+        self.entries = OrderedDict()
+        self.count = 0
+
+    def intern(self, key):
+        """ Gets the number standing for a key, so the keys made from other \
+            keys stay small
+
+        Arguments:
+            key: The key of a factor
+
+        Returns:
+            The number of the key
+        """
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+        self.entries[key] = [self.count, None]
+        self.count += 1
+        self.used += FactorCache.key_size(key)
+        self.evict()
+
+        return self.count - 1
+
+    def get(self, key):
+        """ Gets a factor from the cache
+
+        Arguments:
+            key: The key of the factor
+
+        Returns:
+            The factor, or None if it is not in the cache
+        """
+
+        if key not in self.entries:
+            return None
+
+        self.entries.move_to_end(key)
+
+        return self.entries[key][1]
+
+    def put(self, key, factor):
+        """ Adds a factor to the cache, dropping the least recently used \
+            keys and factors until it fits in the budget
+
+        Arguments:
+            key: The key of the factor, already given a number
+            factor: The factor
+        """
+
+        entry = self.entries.get(key)
+        if (entry is None or entry[1] is not None or
+                factor.values.nbytes > self.budget):
+            return
+
+        entry[1] = factor
+        self.used += factor.values.nbytes
+        self.evict()
+
+    def evict(self):
+        """ Drops the least recently used keys and factors until the cache \
+            fits in the budget, keeping the last one used
+        """
+
+        while self.used > self.budget and len(self.entries) > 1:
+            (key, (number, factor)) = self.entries.popitem(last=False)
+            self.used -= FactorCache.key_size(key)
+            if factor is not None:
+                self.used -= factor.values.nbytes
+
+    @staticmethod
+    def key_size(key):
+        """ Estimates the memory taken by a key
+
+        Arguments:
+            key: The key, a tuple
+
+        Returns:
+            The number of bytes of the key and of its parts
+        """
+
+        return sys.getsizeof(key) + sum(sys.getsizeof(part) for part in key)
+
+
+def Fingerprint(filename):
+    """ Hashes the contents of a file
+
+    Arguments:
+        filename: The file to hash
+
+    Returns:
+        The hexadecimal SHA-256 of the file
+    """
+
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as hashed_file:
+        for block in iter(lambda: hashed_file.read(1 << 16), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
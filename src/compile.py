@@ -0,0 +1,34 @@
+#!/usr/bin/python3
+
+from bayes import *
+from run import ArgParser
+
+
+def main():
+    """ Main function of the program.
+
+    Compiles a Bayesian Network description file into the binary format
+    that BayesN loads without parsing.
+    """
+
+    parser = ArgParser(description="", epilog="")
+    parser.add_argument(
+        "bayes",
+        help="input file where the bayesian network is defined.")
+    parser.add_argument(
+        "output", nargs="?",
+        help="compiled file, by default the input file with the .bnc \
+            extension")
+
+    args = parser.parse_args()
+
+    output = args.output
+    if not output:
+        output = args.bayes[:args.bayes.rfind('.')] + BayesN.COMPILED_EXT
+
+    bn = BayesN(args.bayes)
+    bn.compile(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,25 @@ class ExtensionError(Exception):
                 self.desired_ext))
 
 
+class BNPositionError(Exception):
+    """ Error at some position of the bn input file
+    """
+
+    def __init__(self, line=None, column=None):
+        self.line = line
+        self.column = column
+
+    def where(self):
+        """ Describes the position of the error, if it is known
+        """
+
+        if self.line is None:
+            return ""
+        if self.column is None:
+            return " at line {}".format(self.line)
+        return " at line {}, column {}".format(self.line, self.column)
+
+
 class BNFileError(Exception):
     """ Error in the file
     """
@@ -31,81 +50,60 @@ class BNFileError(Exception):
         return repr(self.ERROR_DICT[self.error_ind])
 
 
-class BNDuplicatedField(Exception):
+class BNDuplicatedField(BNPositionError):
     """ Duplicated Field
     """
 
-    def __init__(self):
-        pass
-
     def __str__(self):
-        return repr("Duplicated Field")
+        return repr("Duplicated Field" + self.where())
 
 
-class BNIncompleteEntry(Exception):
+class BNIncompleteEntry(BNPositionError):
     """ Incomplete Entry
     """
 
-    def __init__(self):
-        pass
-
     def __str__(self):
-        return repr("Incomplete Entry")
+        return repr("Incomplete Entry" + self.where())
 
 
-class BNDuplicatedEntry(Exception):
+class BNDuplicatedEntry(BNPositionError):
     """ Duplicated Entry
     """
 
-    def __init__(self):
-        pass
-
     def __str__(self):
-        return repr("Duplicated Entry")
+        return repr("Duplicated Entry" + self.where())
 
 
-class BNUnknownFieldType(Exception):
+class BNUnknownFieldType(BNPositionError):
     """ Unknown Field Type
     """
 
-    def __init__(self):
-        pass
-
     def __str__(self):
-        return repr("Unknown Field Type")
+        return repr("Unknown Field Type" + self.where())
 
 
-class BNWrongNumberArguments(Exception):
+class BNWrongNumberArguments(BNPositionError):
     """ Wrong Number of Arguments
     """
 
-    def __init__(self):
-        pass
-
     def __str__(self):
-        return repr("Wrong Number of Arguments")
+        return repr("Wrong Number of Arguments" + self.where())
 
 
-class BNDuplicatedNameOrAlias(Exception):
+class BNDuplicatedNameOrAlias(BNPositionError):
     """ Duplicated Name or Alias
     """
 
-    def __init__(self):
-        pass
-
     def __str__(self):
-        return repr("Duplicated Name or Alias")
+        return repr("Duplicated Name or Alias" + self.where())
 
 
-class BNMalformedTable(Exception):
+class BNMalformedTable(BNPositionError):
     """ Malformed Table
     """
 
-    def __init__(self):
-        pass
-
     def __str__(self):
-        return repr("Malformed Table")
+        return repr("Malformed Table" + self.where())
 
 
 class QEIncompleteEvidence(Exception):
@@ -160,4 +158,17 @@ class QEMalformedQuery(Exception):
         pass
 
     def __str__(self):
-        return repr("Malformed Query")
\ No newline at end of file
+        return repr("Malformed Query")
+
+
+class VEFactorTooLarge(Exception):
+    """ Factor larger than the limit for every elimination order
+    """
+
+    def __init__(self, size, limit):
+        self.size = size
+        self.limit = limit
+
+    def __str__(self):
+        return repr("Factor Too Large: {} lines, the limit being {}".format(
+            self.size, self.limit))
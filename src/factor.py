@@ -0,0 +1,113 @@
+""" Factor module
+"""
+
+import numpy
+
+from errors import *
+
+
+class Factor(object):
+    """ Factor of the VE algorithm, stored as a dense array
+
+    Attributes:
+        table_header: Variables of the factor, one per axis of the array.
+        values: Array of probabilities. Each axis is indexed by the position
+            of the value in the values list of the corresponding variable.
+    """
+
+    # Largest number of factors joined with one numpy.einsum call
+    MAX_OPERANDS = 16
+
+    def __init__(self, table_header=[], values=1.0):
+        self.table_header = list(table_header)
+        self.values = numpy.asarray(values, dtype=float)
+
+    @staticmethod
+    def product(factors, table_header):
+        """ Joins the factors on their common variables, summing out the \
+            variables left out of the given header
+
+        Arguments:
+            factors: The several factors to join
+            table_header: Variables of the result, all of them in some factor
+
+        Returns:
+            The factor with the product of all the factors
+        """
+
+        # numpy.einsum takes a limited number of operands, so the factors
+        #are joined in chunks, each one keeping the variables needed later
+        if len(factors) > Factor.MAX_OPERANDS:
+            partial = []
+            for i in range(0, len(factors), Factor.MAX_OPERANDS):
+                chunk = factors[i:i + Factor.MAX_OPERANDS]
+
+                kept = set(table_header)
+                for f in factors[:i] + factors[i + Factor.MAX_OPERANDS:]:
+                    kept.update(f.table_header)
+
+                header = []
+                for f in chunk:
+                    for var in f.table_header:
+                        if var in kept and var not in header:
+                            header.append(var)
+                partial.append(Factor.product(chunk, header))
+
+            return Factor.product(partial, table_header)
+
+        # every variable is identified by its position in the joint header
+        joint = list(table_header)
+        for f in factors:
+            for var in f.table_header:
+                if var not in joint:
+                    joint.append(var)
+
+        # join all the factors at once on their common variables
+        operands = []
+        for f in factors:
+            operands.append(f.values)
+            operands.append([joint.index(var) for var in f.table_header])
+        operands.append(list(range(len(table_header))))
+
+        return Factor(table_header, numpy.einsum(*operands))
+
+    @property
+    def table(self):
+        """ The factor as a list of lines, each one with the value of every
+            variable followed by the probability
+        """
+
+        table = []
+        for index in numpy.ndindex(self.values.shape):
+            line = [self.table_header[i].values[index[i]]
+                    for i in range(len(index))]
+            line.append(float(self.values[index]))
+            table.append(line)
+
+        return table
+
+    def restrict(self, e):
+        """ Removes the evidence from the factor
+
+        Arguments:
+            e: Evidence specified as an event
+
+        Returns:
+            The factor without the axes of the evidence variables
+        """
+
+        if not [var for var in self.table_header if var in e]:
+            return self
+
+        index = []
+        header = []
+        for var in self.table_header:
+            if var in e:
+                if e[var] not in var.index:
+                    raise QEMalformedEvidence
+                index.append(var.index[e[var]])
+            else:
+                index.append(slice(None))
+                header.append(var)
+
+        return Factor(header, self.values[tuple(index)])
@@ -0,0 +1,311 @@
+""" Junction Tree Algorithm
+"""
+
+import numpy
+
+from errors import *
+from factor import Factor
+from ordering import interaction_graph, eliminate, min_fill
+
+
+class JunctionTree(object):
+    """ Clique tree of a Bayesian Network, calibrated with message passing \
+        so the posterior of every variable comes out of a single run
+
+    The tree can be kept as an inference session: changing the evidence of
+    one variable only computes again the messages that depend on it.
+
+    Attributes:
+        bn: The bayesian network on which to perform the algorithm.
+        e: The evidence specified as an event.
+        cliques: The variables of each clique.
+        neighbours: The cliques connected to each clique in the tree.
+        home: The clique holding each variable.
+        families: The clique holding each node and its parents.
+        base: The product of the CPTs assigned to each clique.
+        potentials: The product of the CPTs and evidence of each clique.
+        messages: The message sent between each pair of neighbour cliques.
+    """
+
+    def __init__(self, bn, e):
+        self.bn = bn
+        self.e = dict(e)
+        self.messages = {}
+
+        self.build_cliques()
+        self.build_potentials()
+        self.calibrate()
+
+    def build_cliques(self):
+        """ Moralises and triangulates the network, keeping the maximal \
+            cliques of the triangulated graph joined in a tree
+
+        Each elimination makes a clique with the variable and its neighbours
+        at that moment, which is joined to the clique of the neighbour
+        eliminated first: it holds all the other neighbours. A clique is
+        only left out when it is contained in a clique joined to it, the
+        one that contains it taking its place in the tree.
+        """
+
+        nodes = self.bn["list"]
+        position = dict((node, i) for (i, node) in enumerate(nodes))
+        graph = interaction_graph(nodes, {})
+        order = min_fill(nodes, [], {})
+        eliminated = dict((var, k) for (k, var) in enumerate(order))
+
+        cliques = []
+        parent = []
+        for variable in order:
+            neighbours = sorted(graph[variable], key=position.get)
+            cliques.append([variable] + neighbours)
+            parent.append(min([eliminated[var] for var in neighbours],
+                              default=None))
+            eliminate(graph, variable)
+
+        # the clique each left out clique was merged into, a clique holding
+        #one variable less than one joined to it being contained in it
+        merged = {}
+        for k in range(len(order)):
+            p = parent[k]
+            if (p is not None and p not in merged and
+                    len(cliques[p]) == len(cliques[k]) - 1):
+                merged[p] = k
+
+        # the index of the clique that takes the place of each one, a
+        #clique being merged into one eliminated before it
+        kept = []
+        self.cliques = []
+        for k in range(len(order)):
+            if k in merged:
+                kept.append(kept[merged[k]])
+            else:
+                kept.append(len(self.cliques))
+                self.cliques.append(cliques[k])
+
+        self.neighbours = [[] for clique in self.cliques]
+        for k in range(len(order)):
+            if parent[k] is not None:
+                (i, j) = (kept[k], kept[parent[k]])
+                if i != j:
+                    self.neighbours[i].append(j)
+                    self.neighbours[j].append(i)
+
+        # a family is a clique of the moral graph, so its first variable
+        #eliminated has all the others as neighbours
+        self.home = dict((var, kept[eliminated[var]]) for var in order)
+        self.families = {}
+        for node in nodes:
+            first = min([node] + node.parents["list"], key=eliminated.get)
+            self.families[node] = self.home[first]
+
+    def build_potentials(self):
+        """ Assigns each CPT, and the evidence on each variable, to a \
+            clique that holds all of its variables
+        """
+
+        self.base = []
+        for clique in self.cliques:
+            self.base.append(Factor(clique, numpy.ones(
+                [len(var.values) for var in clique])))
+
+        assigned = [[] for clique in self.cliques]
+        for node in self.bn["list"]:
+            assigned[self.families[node]].append(node.factor)
+
+        for i in range(len(self.cliques)):
+            self.base[i] = Factor.product([self.base[i]] + assigned[i],
+                                          self.cliques[i])
+
+        self.potentials = list(self.base)
+        for i in set(self.home[var] for var in self.e):
+            self.update_potential(i)
+
+    def update_potential(self, i):
+        """ Multiplies the CPTs of a clique by the evidence assigned to it
+
+        Arguments:
+            i: Index of the clique
+        """
+
+        factors = [self.base[i]]
+        for var in self.e:
+            if self.home[var] != i:
+                continue
+            if self.e[var] not in var.index:
+                raise QEMalformedEvidence
+            indicator = numpy.zeros(len(var.values))
+            indicator[var.index[self.e[var]]] = 1
+            factors.append(Factor([var], indicator))
+
+        self.potentials[i] = Factor.product(factors, self.cliques[i])
+
+    def set_evidence(self, variable, value):
+        """ Adds or changes the evidence on a variable, only the messages \
+            that depend on it being computed again
+
+        Arguments:
+            variable: The evidence variable
+            value: Its value, in lowercase
+        """
+
+        # a wrong value is rejected before it gets into the session
+        if value not in variable.index:
+            raise QEMalformedEvidence
+
+        self.e[variable] = value
+        self.update_evidence(variable)
+
+    def retract_evidence(self, variable):
+        """ Removes the evidence on a variable, only the messages that \
+            depend on it being computed again
+
+        Arguments:
+            variable: The variable that is no longer evidence
+        """
+
+        del self.e[variable]
+        self.update_evidence(variable)
+
+    def update_evidence(self, variable):
+        """ Updates the clique holding the evidence on a variable and \
+            calibrates the tree again
+
+        Arguments:
+            variable: The variable whose evidence changed
+        """
+
+        i = self.home[variable]
+        self.update_potential(i)
+
+        # the messages sent away from the clique depend on its potential,
+        #the ones sent towards it do not
+        visited = set([i])
+        queue = [i]
+        while queue:
+            a = queue.pop(0)
+            for b in self.neighbours[a]:
+                if b not in visited:
+                    visited.add(b)
+                    queue.append(b)
+                    del self.messages[(a, b)]
+
+        self.calibrate()
+
+    def calibrate(self):
+        """ Sends the messages from the leaves to the root of each tree and \
+            back from the root to the leaves, skipping the messages that \
+            are already known
+        """
+
+        # depth first order of the cliques, with the parent of each one
+        order = []
+        parent = {}
+        for root in range(len(self.cliques)):
+            if root in parent:
+                continue
+            parent[root] = None
+            stack = [root]
+            while stack:
+                i = stack.pop()
+                order.append(i)
+                for j in self.neighbours[i]:
+                    if j not in parent:
+                        parent[j] = i
+                        stack.append(j)
+
+        for i in reversed(order):
+            if parent[i] is not None and (i, parent[i]) not in self.messages:
+                self.send_message(i, parent[i])
+
+        for i in order:
+            if parent[i] is not None and (parent[i], i) not in self.messages:
+                self.send_message(parent[i], i)
+
+    def send_message(self, i, j):
+        """ Computes the message from clique i to its neighbour j
+
+        Arguments:
+            i: Index of the clique that sends the message
+            j: Index of the clique that receives the message
+        """
+
+        factors = [self.potentials[i]]
+        for k in self.neighbours[i]:
+            if k != j:
+                factors.append(self.messages[(k, i)])
+
+        sepset = [var for var in self.cliques[i] if var in self.cliques[j]]
+        message = Factor.product(factors, sepset)
+
+        # messages are scaled to avoid underflow, the beliefs are
+        #normalized in the end anyway
+        total = message.values.sum()
+        if total:
+            message.values /= total
+
+        self.messages[(i, j)] = message
+
+    def belief(self, i):
+        """ Computes the belief of a calibrated clique
+
+        Arguments:
+            i: Index of the clique
+
+        Returns:
+            The factor with the product of the potential of the clique and \
+            all the messages it received
+        """
+
+        factors = [self.potentials[i]]
+        for k in self.neighbours[i]:
+            factors.append(self.messages[(k, i)])
+
+        return Factor.product(factors, self.cliques[i])
+
+    def marginal(self, variable):
+        """ Computes the posterior of a variable given the evidence
+
+        Arguments:
+            variable: The query variable
+
+        Returns:
+            The normalized factor of the variable
+        """
+
+        belief = self.belief(self.home[variable])
+
+        return JunctionTree.normalize(Factor.product([belief], [variable]))
+
+    def marginals(self):
+        """ Computes the posterior of every variable given the evidence
+
+        Returns:
+            A list with the normalized factor of each variable, in the same \
+            order as the nodes of the network
+        """
+
+        beliefs = {}
+        marginals = []
+        for node in self.bn["list"]:
+            i = self.home[node]
+            if i not in beliefs:
+                beliefs[i] = self.belief(i)
+
+            marginals.append(JunctionTree.normalize(
+                Factor.product([beliefs[i]], [node])))
+
+        return marginals
+
+    @staticmethod
+    def normalize(factor):
+        """ Normalizes the probabilities of a factor
+
+        Arguments:
+            factor: The factor to normalize
+
+        Returns:
+            The normalized factor (the sum of all probabilities is 1)
+        """
+
+        return Factor(factor.table_header,
+                      factor.values / factor.values.sum())
@@ -0,0 +1,229 @@
+""" Elimination ordering heuristics
+"""
+
+import heapq
+
+
+def interaction_graph(nodes, e):
+    """ Builds the graph in which two variables are connected if they \
+        show up together in a factor
+
+    Arguments:
+        nodes: Nodes of the belief network
+        e: Evidence specified as an event, its variables are left out
+
+    Returns:
+        A dictionary with the set of neighbours of each variable
+    """
+
+    graph = {}
+    for node in nodes:
+        if node not in e:
+            graph[node] = set()
+
+    for node in nodes:
+        scope = [var for var in [node] + node.parents["list"]
+                 if var not in e]
+        for var in scope:
+            graph[var].update(scope)
+            graph[var].discard(var)
+
+    return graph
+
+
+def eliminate(graph, variable):
+    """ Removes a variable from the graph, connecting all its neighbours
+
+    Arguments:
+        graph: The interaction graph
+        variable: The variable to remove
+
+    Returns:
+        The number of lines of the factor created by the elimination
+    """
+
+    size = len(variable.values)
+    neighbours = graph.pop(variable)
+    for var in neighbours:
+        size *= len(var.values)
+        graph[var].discard(variable)
+        graph[var].update(neighbours)
+        graph[var].discard(var)
+
+    return size
+
+
+def min_degree_cost(graph, variable):
+    """ Number of neighbours of the variable
+    """
+
+    return len(graph[variable])
+
+
+def min_fill_cost(graph, variable):
+    """ Number of edges added to the graph by eliminating the variable
+    """
+
+    neighbours = list(graph[variable])
+    cost = 0
+    for i in range(len(neighbours)):
+        for j in range(i + 1, len(neighbours)):
+            if neighbours[j] not in graph[neighbours[i]]:
+                cost += 1
+
+    return cost
+
+
+def weighted_min_fill_cost(graph, variable):
+    """ Sum of the weights of the edges added to the graph by eliminating \
+        the variable, the weight of an edge being the product of the \
+        number of values of its ends
+    """
+
+    neighbours = list(graph[variable])
+    cost = 0
+    for i in range(len(neighbours)):
+        for j in range(i + 1, len(neighbours)):
+            if neighbours[j] not in graph[neighbours[i]]:
+                cost += (len(neighbours[i].values) *
+                         len(neighbours[j].values))
+
+    return cost
+
+
+def greedy_order(nodes, X, e, cost):
+    """ Orders the hidden variables by greedily eliminating the one with \
+        the lowest cost
+
+    Arguments:
+        nodes: Nodes of the belief network
+        X: Query variables
+        e: Evidence specified as an event
+        cost: Function giving the cost of eliminating a variable of the graph
+
+    Returns:
+        All the nodes, the hidden ones in elimination order followed by the \
+        query and the evidence
+    """
+
+    graph = interaction_graph(nodes, e)
+    hidden = [node for node in nodes if node not in X and node not in e]
+    position = dict((node, i) for (i, node) in enumerate(hidden))
+    order = []
+
+    # the current cost of each hidden variable, and a queue in which it
+    #can also have outdated costs, ties being broken by the order of the
+    #nodes in the network
+    costs = dict((var, cost(graph, var)) for var in hidden)
+    queue = [(costs[var], position[var], var) for var in hidden]
+    heapq.heapify(queue)
+
+    while queue:
+        (best_cost, i, best) = heapq.heappop(queue)
+        if best not in costs or costs[best] != best_cost:
+            continue
+
+        # only the costs of the variables next to the eliminated one, or
+        #next to those, can change: the edges added join its neighbours
+        neighbours = graph[best]
+        changed = set(neighbours)
+        for var in neighbours:
+            changed.update(graph[var])
+
+        eliminate(graph, best)
+        del costs[best]
+        order.append(best)
+
+        for var in changed:
+            if var in costs:
+                costs[var] = cost(graph, var)
+                heapq.heappush(queue, (costs[var], position[var], var))
+
+    eliminated = set(order)
+    return order + [node for node in nodes if node not in eliminated]
+
+
+def min_degree(nodes, X, e):
+    """ Min-degree elimination order
+    """
+
+    return greedy_order(nodes, X, e, min_degree_cost)
+
+
+def min_fill(nodes, X, e):
+    """ Min-fill elimination order
+    """
+
+    return greedy_order(nodes, X, e, min_fill_cost)
+
+
+def weighted_min_fill(nodes, X, e):
+    """ Weighted min-fill elimination order
+    """
+
+    return greedy_order(nodes, X, e, weighted_min_fill_cost)
+
+
+def elimination_plan(nodes, order, X, e):
+    """ Predicts the factors built when eliminating the variables in the \
+        given order, without building them
+
+    Arguments:
+        nodes: Nodes of the belief network
+        order: Order in which the variables are processed
+        X: Query variables
+        e: Evidence specified as an event
+
+    Returns:
+        A list with each hidden variable, in elimination order, the \
+        variables of the product of the factors that mention it and the \
+        number of lines of that product
+    """
+
+    graph = interaction_graph(nodes, e)
+
+    plan = []
+    for variable in order:
+        if variable not in X and variable not in e:
+            scope = [variable] + sorted(graph[variable],
+                                        key=lambda var: var.name)
+            plan.append((variable, scope, eliminate(graph, variable)))
+
+    return plan
+
+
+def max_factor_size(nodes, order, X, e):
+    """ Predicts the number of lines of the largest factor built when \
+        eliminating the variables in the given order
+
+    Arguments:
+        nodes: Nodes of the belief network
+        order: Order in which the variables are processed
+        X: Query variables
+        e: Evidence specified as an event
+
+    Returns:
+        The number of lines of the largest factor
+    """
+
+    # the factors of the CPTs, without the evidence
+    size = 1
+    for node in nodes:
+        lines = 1
+        for var in [node] + node.parents["list"]:
+            if var not in e:
+                lines *= len(var.values)
+        size = max(size, lines)
+
+    for (variable, scope, lines) in elimination_plan(nodes, order, X, e):
+        size = max(size, lines)
+
+    return size
+
+
+# Elimination orders that can be used instead of the leaf to root one
+ORDERINGS = {
+    "min-degree": min_degree,
+    "min-fill": min_fill,
+    "weighted-min-fill": weighted_min_fill
+}
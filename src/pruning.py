@@ -0,0 +1,97 @@
+""" Pruning of the nodes irrelevant to a query
+"""
+
+
+def ancestral_nodes(nodes, variables):
+    """ Gets the given variables and all their ancestors
+
+    Removing every other node is the same as repeatedly removing the barren
+    nodes, the leaves that are neither query nor evidence.
+
+    Arguments:
+        nodes: Nodes of the belief network
+        variables: Variables whose ancestors are wanted
+
+    Returns:
+        The ancestral nodes, in the same order as in nodes
+    """
+
+    ancestors = set()
+    stack = list(variables)
+    while stack:
+        node = stack.pop()
+        if node not in ancestors:
+            ancestors.add(node)
+            stack += node.parents["list"]
+
+    return [node for node in nodes if node in ancestors]
+
+
+def connected_nodes(nodes, variables, e):
+    """ Gets the nodes connected to the query in the moral graph once the \
+        evidence is removed, the others being d-separated from it
+
+    Arguments:
+        nodes: Ancestral nodes of the query and evidence
+        variables: Query variables, none of them in the evidence
+        e: Evidence specified as an event
+
+    Returns:
+        The set of nodes connected to some query variable
+    """
+
+    # moral graph: each CPT connects the node and all its parents
+    graph = {}
+    for node in nodes:
+        if node not in e:
+            graph[node] = set()
+
+    for node in nodes:
+        scope = [var for var in [node] + node.parents["list"]
+                 if var not in e]
+        for var in scope:
+            graph[var].update(scope)
+
+    connected = set()
+    stack = list(variables)
+    while stack:
+        node = stack.pop()
+        if node not in connected:
+            connected.add(node)
+            stack += graph[node]
+
+    return connected
+
+
+def relevant_nodes(nodes, X, e):
+    """ Drops the barren nodes and the ones d-separated from the query \
+        given the evidence
+
+    Arguments:
+        nodes: Nodes of the belief network
+        X: Query variable, or list of query variables
+        e: Evidence specified as an event
+
+    Returns:
+        The nodes whose CPT is needed to answer the query, in the same \
+        order as in nodes
+    """
+
+    variables = X if isinstance(X, list) else [X]
+    nodes = ancestral_nodes(nodes, variables + list(e))
+
+    query = [var for var in variables if var not in e]
+    if not query:
+        return nodes
+
+    # a CPT whose variables, once the evidence is removed, are not connected
+    #to the query only scales the result by a constant
+    connected = connected_nodes(nodes, query, e)
+    relevant = []
+    for node in nodes:
+        for var in [node] + node.parents["list"]:
+            if var in connected:
+                relevant.append(node)
+                break
+
+    return relevant
@@ -11,14 +11,21 @@ class QandE(object):
     Attributes:
         filename(str): Query and Evidence input file.
         evidence(dict): The evidence
-        query(str): The query
+        query(list): The query variables, whose joint distribution is wanted
+        map(list): The variables whose most probable values are wanted, \
+            empty for all the variables not in the evidence, or None if \
+            the query is not a MAP one
     """
 
-    def __init__(self, filename):
+    def __init__(self, filename=None):
 
         self.filename = filename
         self.evidence = {}
-        self.query = None
+        self.query = []
+        self.map = None
+
+        if not filename:
+            return
 
         CheckExtension(self.filename)
 
@@ -37,27 +44,46 @@ class QandE(object):
             if line[0] == '#' or not elements:
                 continue
 
-            if elements[0] == "QUERY":
-                if self.query:
-                    raise QEDuplicatedQuery
+            self.parse_line(elements)
+
+    def parse_line(self, elements):
+        """ Parses one line of a Query and Evidence file
+
+        Arguments:
+            elements: The fields of the line
+        """
+
+        if elements[0] == "QUERY":
+            if self.query or self.map is not None:
+                raise QEDuplicatedQuery
+
+            if len(elements) < 2:
+                raise QEMalformedQuery
+
+            self.query = elements[1:]
+
+        elif elements[0] in ("MAP", "MPE"):
+            if self.query or self.map is not None:
+                raise QEDuplicatedQuery
 
-                if len(elements) != 2:
-                    raise QEMalformedQuery
+            # MAP names the variables, MPE stands for all of them
+            if (elements[0] == "MAP") == (len(elements) == 1):
+                raise QEMalformedQuery
 
-                self.query = elements[1]
+            self.map = elements[1:]
 
-            elif elements[0] == "EVIDENCE":
-                if self.evidence:
-                    raise QEDuplicatedEvidence
+        elif elements[0] == "EVIDENCE":
+            if self.evidence:
+                raise QEDuplicatedEvidence
 
-                if len(elements) < 2:
-                    raise QEIncompleteEvidence
+            if len(elements) < 2:
+                raise QEIncompleteEvidence
 
-                if len(elements) - 2 != int(elements[1]) * 2:
-                    raise QEMalformedEvidence
+            if len(elements) - 2 != int(elements[1]) * 2:
+                raise QEMalformedEvidence
 
-                for i in range(int(elements[1])):
-                    self.evidence[elements[2*(i+1)]] = elements[2*(i+1)+1].lower()
+            for i in range(int(elements[1])):
+                self.evidence[elements[2*(i+1)]] = elements[2*(i+1)+1].lower()
 
     def write_solution(self, distrib, verbose):
         """ Write the solution contained in distrib to the solution file.
@@ -69,21 +95,89 @@ class QandE(object):
 
         out_filename = self.filename[:self.filename.rfind('.')] + ".sol"
 
+        out_file = open(out_filename, 'w+')
+        self.write_answer(out_file, distrib, verbose)
+        out_file.close()
+
+    def write_marginals(self, marginals):
+        """ Write the posterior of every variable to the solution file.
+
+        Arguments:
+            marginals: The normalized factor of each variable.
+        """
+
+        out_filename = self.filename[:self.filename.rfind('.')] + ".sol"
+
         out_file = open(out_filename, 'w+')
 
         out_file.write("########## SOLUTION ##########\n")
 
-        out_file.write("QUERY {}\n".format(self.query))
+        evid_str = "EVIDENCE"
+        for evid in self.evidence:
+            evid_str += " {} {}".format(evid, self.evidence[evid])
+        out_file.write(evid_str + "\n")
+
+        for marginal in marginals:
+            out_file.write("QUERY {}\n".format(marginal.table_header[0].name))
+
+            probab_str = "QUERY_DIST"
+            for probab in marginal.table:
+                probab_str += " {} {}".format(probab[0], probab[-1])
+            out_file.write(probab_str + "\n")
+
+        out_file.close()
+
+    def write_answer(self, out_file, distrib, verbose):
+        """ Write the solution contained in distrib to an open file.
+
+        Arguments:
+            out_file: The file on which to write.
+            distrib: The VE object containing the result of the algorithm.
+            verbose: Whether or not to write each step to the solution file.
+        """
+
+        out_file.write("########## SOLUTION ##########\n")
+
+        if self.map is None:
+            out_file.write("QUERY {}\n".format(" ".join(self.query)))
+        elif self.map:
+            out_file.write("MAP {}\n".format(" ".join(self.map)))
+        else:
+            out_file.write("MPE\n")
 
         evid_str = "EVIDENCE"
         for evid in self.evidence:
             evid_str += " {} {}".format(evid, self.evidence[evid])
         out_file.write(evid_str + "\n")
 
-        probab_str = "QUERY_DIST"
-        for probab in distrib.result.table:
-            probab_str += " {} {}".format(probab[0], probab[-1])
-        out_file.write(probab_str + "\n")
+        # the query was rejected for the size of its factors
+        if hasattr(distrib, "limit"):
+            out_file.write("FACTOR_TOO_LARGE {} {}\n".format(
+                distrib.size, distrib.limit))
+        elif self.map is not None:
+            assign_str = "MAP_ASSIGNMENT"
+            for (var, value) in distrib.assignment:
+                assign_str += " {} {}".format(var.name, value)
+            out_file.write(assign_str + "\n")
+            out_file.write("MAP_PROBABILITY {}\n".format(distrib.probability))
+        else:
+            # the values of the query variables followed by the probability,
+            #a result without variables writing its probability twice
+            probab_str = "QUERY_DIST"
+            for probab in distrib.result.table:
+                values = probab[:max(1, len(probab) - 1)]
+                probab_str += " {} {}".format(
+                    " ".join(str(value) for value in values), probab[-1])
+            out_file.write(probab_str + "\n")
+
+        # the sampling engines only estimate the distribution
+        if hasattr(distrib, "error"):
+            out_file.write("SAMPLES {}\n".format(distrib.samples))
+
+            error_str = "QUERY_ERROR"
+            for (probab, error) in zip(distrib.result.table, distrib.error):
+                error_str += " {} {}".format(probab[0], float(error))
+            out_file.write(error_str + "\n")
 
         if verbose:
             # write steps
@@ -91,6 +185,70 @@ class QandE(object):
             for log_line in distrib.log:
                 out_file.write(log_line+"\n")
 
+
+class QandEBatch(object):
+    """ Represents several queries, each one with its evidence
+
+    A new query starts at every QUERY, MAP, MPE or EVIDENCE line that the
+    current query already has, so each QUERY and EVIDENCE pair is one query.
+
+    Attributes:
+        filename(str): Query and Evidence input file.
+        queries(list): The queries, as QandE objects, in file order
+    """
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        self.queries = []
+
+        CheckExtension(self.filename)
+
+        self.parse_file()
+
+    def parse_file(self):
+        """ Parses a Query and Evidence file with several queries
+        """
+
+        qefile = open(self.filename, 'r')
+
+        current = QandE()
+        for line in qefile:
+            elements = line.split()
+
+            # Ignore comment lines and blank lines
+            if line[0] == '#' or not elements:
+                continue
+
+            # beginning of a new query
+            if ((elements[0] in ("QUERY", "MAP", "MPE") and
+                    (current.query or current.map is not None)) or
+                    (elements[0] == "EVIDENCE" and current.evidence)):
+                self.queries.append(current)
+                current = QandE()
+
+            current.parse_line(elements)
+
+        if current.query or current.map is not None or current.evidence:
+            self.queries.append(current)
+
+        for query in self.queries:
+            if not query.query and query.map is None:
+                raise QEMalformedQuery
+
+    def write_solution(self, distribs, verbose):
+        """ Write the solutions of all the queries to the solution file.
+
+        Arguments:
+            distribs: The VE objects with the results, one per query.
+            verbose: Whether or not to write each step to the solution file.
+        """
+
+        out_filename = self.filename[:self.filename.rfind('.')] + ".sol"
+
+        out_file = open(out_filename, 'w+')
+        for query, distrib in zip(self.queries, distribs):
+            query.write_answer(out_file, distrib, verbose)
         out_file.close()
 
 
@@ -2,12 +2,18 @@
 
 from argparse import ArgumentParser
 from argparse import ArgumentDefaultsHelpFormatter
+import json
 import logging
 import sys
 
 from bayes import *
 from qe import *
 from ve import *
+from jt import *
+from cache import *
+from ordering import ORDERINGS
+from sampling import ENGINES, Sampler
+from stats import Stats
 
 
 class ArgParser(ArgumentParser):
@@ -41,8 +47,53 @@ def main():
     parser.add_argument(
         "qande",
         help="input file where the query and evidence are defined.")
+    parser.add_argument("-b", "--batch", action="store_true",
+                        help="solve every QUERY and EVIDENCE pair of the \
+                            query and evidence file")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of processes among which to split the \
+                            queries of a batch, or the samples of each query \
+                            of the sampling engines")
+    parser.add_argument("-a", "--all-marginals", action="store_true",
+                        help="write the posterior of every variable given \
+                            the evidence, using a junction tree")
+    parser.add_argument("-e", "--engine", default="ve",
+                        choices=["ve"] + sorted(ENGINES),
+                        help="algorithm that answers the queries, the \
+                            sampling ones estimating the distribution")
+    parser.add_argument("--samples", type=int, default=10000,
+                        help="number of samples drawn by the sampling \
+                            engines for each query (0 for no limit)")
+    parser.add_argument("--seconds", type=float, default=0,
+                        help="time spent by the sampling engines on each \
+                            query (0 for no limit)")
+    parser.add_argument("--seed", type=int,
+                        help="seed of the sampling engines")
+    parser.add_argument("-c", "--cache",
+                        help="file where the results are kept between runs \
+                            on the same network")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="maximum number of results kept in the cache")
+    parser.add_argument("-m", "--memo", type=float, default=0,
+                        help="megabytes of factors made by summing out \
+                            hidden variables kept to be reused by other \
+                            queries (0 to disable)")
+    parser.add_argument("--cpt-file",
+                        help="file where the CPTs are written to and mapped \
+                            from, instead of being kept in memory")
+    parser.add_argument("-p", "--profile", action="store_true",
+                        help="write the time and work spent in each phase \
+                            of the VE algorithm to the console, as JSON")
     parser.add_argument("-verbose", action="store_true",
                         help="Print out all steps of the VE algorithm")
+    parser.add_argument("-o", "--order", default="topological",
+                        choices=["topological"] + sorted(ORDERINGS),
+                        help="order in which the hidden variables are \
+                            eliminated")
+    parser.add_argument("--max-factor-size", type=int, default=0,
+                        help="maximum number of lines of a factor, another \
+                            order being used or the query rejected when \
+                            the order given would exceed it (0 for no limit)")
     parser.add_argument("-l", "--logfile",
                         help="file where the log is to be written to (instead \
                             of the console)")
@@ -52,6 +103,12 @@ def main():
 
     args = parser.parse_args()
 
+    if args.engine != "ve" and args.samples <= 0 and args.seconds <= 0:
+        parser.error("the sampling engines need samples or seconds")
+    if args.all_marginals and args.batch:
+        parser.error("the marginals are written for a single evidence, "
+                     "not for a batch")
+
     logging.basicConfig(format='%(asctime)s %(message)s',
                         datefmt='%Y/%m/%d %H:%M:%S',
                         filename=args.logfile,
@@ -61,19 +118,69 @@ def main():
 
     # Parses the Bayesian Network description file
     logging.debug("Parsing file {}".format(args.bayes))
-    bn = BayesN(args.bayes)
+    bn = BayesN(args.bayes, args.cpt_file)
     logging.debug("Done parsing BN file")
 
     # Parses the query and evidence description file
     logging.debug("Parsing file {}".format(args.qande))
-    qe = QandE(args.qande)
+    if args.batch:
+        qe = QandEBatch(args.qande)
+    else:
+        qe = QandE(args.qande)
     logging.debug("Done parsing Q&E file")
 
-    # Parses the query and evidence description file
+    if args.all_marginals:
+        logging.debug("Calibrating junction tree...")
+        jt = JunctionTree(bn.nodes, VE.resolve_evidence(bn.nodes, qe.evidence))
+        logging.debug("Calibrated!")
+
+        logging.debug("Writing solution file...")
+        qe.write_marginals(jt.marginals())
+        logging.debug("Solution written to file!")
+        return
+
+    if args.engine != "ve":
+        logging.debug("Sampling...")
+        distribs = Sampler.batch(ENGINES[args.engine], bn.nodes,
+                                 qe.queries if args.batch else [qe],
+                                 args.samples or None, args.seconds or None,
+                                 args.seed, args.jobs)
+        logging.debug("Sampled!")
+
+        logging.debug("Writing solution file...")
+        qe.write_solution(distribs if args.batch else distribs[0],
+                          args.verbose)
+        logging.debug("Solution written to file!")
+        return
+
+    # a single query only needs the cache to keep its result between runs,
+    #and the network is only hashed then
+    cache = None
+    if args.cache or args.batch:
+        cache = ResultCache(Fingerprint(args.bayes), args.cache_size,
+                            args.cache)
+    memo = FactorCache(int(args.memo * 2**20)) if args.memo > 0 else None
+    stats = Stats() if args.profile else None
+
+    # Solves the queries
     logging.debug("Solving...")
-    ve = VE(bn.nodes, qe, args.verbose)
+    if args.batch:
+        ve = VE.batch(bn.nodes, qe.queries, args.verbose,
+                      ORDERINGS.get(args.order), args.jobs, cache, memo,
+                      stats, args.max_factor_size)
+    else:
+        ve = VE.batch(bn.nodes, [qe], args.verbose,
+                      ORDERINGS.get(args.order), 1, cache, memo, stats,
+                      args.max_factor_size)[0]
     logging.debug("Solved!")
 
+    if stats:
+        json.dump(stats.report(), sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+    if args.cache:
+        cache.save()
+
     logging.debug("Writing solution file...")
     qe.write_solution(ve, args.verbose)
     logging.debug("Solution written to file!")
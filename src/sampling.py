@@ -0,0 +1,450 @@
+""" Approximate inference by sampling
+"""
+
+from abc import ABCMeta, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+import time
+
+import numpy
+
+from errors import *
+from factor import Factor
+from pruning import relevant_nodes
+from ve import VE
+
+
+# State of a worker process of a parallel sampling
+WORKER = {}
+
+
+class Estimate(object):
+    """ Estimate merged from the samples drawn in several processes
+
+    Attributes:
+        result: The estimated posterior of the query.
+        error: The standard error of each probability of the result.
+        samples: Number of samples the estimate is made of.
+        log: The log array, always empty.
+    """
+
+    def __init__(self, result, error, samples):
+        self.result = result
+        self.error = error
+        self.samples = samples
+        self.log = []
+
+
+class Sampler(object, metaclass=ABCMeta):
+    """ Base of the sampling engines, which estimate the posterior of the \
+        query variable from samples drawn many at a time
+
+    Attributes:
+        bn: The beysian network on which to perform the algorithm.
+        qe: The dictionary containing the evidence.
+        query: The query.
+        nodes: The nodes relevant to the query, parents before children.
+        rng: The numpy random generator.
+        samples: Number of samples the estimate is made of.
+        sums: What the engine keeps of the samples, which can be merged \
+            with the sums of other samplers of the same query.
+        result: The estimated posterior of the query.
+        error: The standard error of each probability of the result.
+        log: The log array, always empty.
+    """
+
+    # Number of samples drawn with each numpy call
+    BATCH = 1000
+
+    def __init__(self, bn, qe, samples=10000, seconds=None, seed=None):
+        self.bn = bn
+        if len(qe.query) != 1:
+            raise QEMalformedQuery
+        self.qe = VE.resolve_evidence(bn, qe.evidence)
+        self.query = VE.resolve_query(bn, qe.query, self.qe)[0]
+        self.rng = numpy.random.default_rng(seed)
+        self.log = []
+
+        for var in self.qe:
+            if self.qe[var] not in var.index:
+                raise QEMalformedEvidence
+
+        # only the nodes relevant to the query are sampled, from root to
+        #leaf
+        self.nodes = VE.sort_nodes(
+            relevant_nodes(bn["list"], self.query, self.qe))
+        self.nodes.reverse()
+
+        self.samples = 0
+        self.sums = self.draw(samples, seconds)
+        (self.result, self.error) = self.estimate(self.query, [self.sums])
+
+    @abstractmethod
+    def draw(self, samples, seconds):
+        """ Draws samples until the budget is spent
+
+        Arguments:
+            samples: Number of samples to draw, None for no limit
+            seconds: Time to spend drawing them, None for no limit
+
+        Returns:
+            The sums of the samples
+        """
+
+    @staticmethod
+    @abstractmethod
+    def estimate(query, parts):
+        """ Estimates the posterior of the query from the samples of one \
+            or more samplers
+
+        Arguments:
+            query: Query variable
+            parts: The sums of each sampler
+
+        Returns:
+            The estimated posterior of the query and its standard error
+        """
+
+    @staticmethod
+    def batch(engine, bn, queries, samples=10000, seconds=None, seed=None,
+              jobs=1):
+        """ Answers several queries, the samples of each one being split \
+            among several processes
+
+        Every query, and every process within a query, draws from its own
+        stream spawned from the seed, so the results only depend on the
+        seed and the number of processes.
+
+        Arguments:
+            engine: The Sampler subclass
+            bn: Belief network
+            queries: The QandE objects with the queries
+            samples: Number of samples of each query, None for no limit
+            seconds: Time spent by each process on each query, None for \
+                no limit
+            seed: Seed of the streams
+            jobs: Number of processes among which to split the samples
+
+        Returns:
+            The estimates, one per query and in the same order
+        """
+
+        streams = numpy.random.SeedSequence(seed).spawn(len(queries))
+
+        if jobs <= 1:
+            return [engine(bn, qe, samples, seconds, stream)
+                    for (qe, stream) in zip(queries, streams)]
+
+        # the share of the samples of each process, the first ones drawing
+        #the remainder
+        shares = [None for n in range(jobs)]
+        if samples is not None:
+            shares = [samples // jobs + (1 if n < samples % jobs else 0)
+                      for n in range(jobs)]
+
+        tasks = []
+        for (i, stream) in enumerate(streams):
+            for (share, child) in zip(shares, stream.spawn(jobs)):
+                if share != 0:
+                    tasks.append((i, (engine, queries[i], share, seconds,
+                                      child)))
+
+        # the network is sent once to each process, not with every query
+        with ProcessPoolExecutor(jobs, initializer=Sampler.init_worker,
+                                 initargs=(bn,)) as ex:
+            drawn = list(ex.map(Sampler.draw_worker,
+                                [task for (i, task) in tasks]))
+
+        estimates = []
+        for (i, qe) in enumerate(queries):
+            parts = [drawn[n] for n in range(len(tasks)) if tasks[n][0] == i]
+            query = bn["dict"][qe.query[0]]
+            (result, error) = engine.estimate(
+                query, [sums for (count, sums) in parts])
+            estimates.append(Estimate(result, error,
+                                      sum(count for (count, sums) in parts)))
+
+        return estimates
+
+    @staticmethod
+    def init_worker(bn):
+        """ Keeps the network in a worker process of a parallel sampling
+
+        Arguments:
+            bn: Belief network
+        """
+
+        WORKER["bn"] = bn
+
+    @staticmethod
+    def draw_worker(task):
+        """ Draws the share of the samples of a query of one process
+
+        Arguments:
+            task: The Sampler subclass, the QandE object with the query, \
+                the number of samples, the time budget and the stream
+
+        Returns:
+            The number of samples drawn and their sums
+        """
+
+        (engine, qe, samples, seconds, stream) = task
+        sampler = engine(WORKER["bn"], qe, samples, seconds, stream)
+
+        return (sampler.samples, sampler.sums)
+
+    @staticmethod
+    def spent(drawn, samples, start, seconds):
+        """ Checks whether the budget of the sampling is spent
+
+        Arguments:
+            drawn: Number of samples drawn
+            samples: Number of samples to draw, None for no limit
+            start: Time at which the sampling started
+            seconds: Time to spend, None for no limit
+
+        Returns:
+            Whether or not to stop drawing samples
+        """
+
+        if samples is not None and drawn >= samples:
+            return True
+
+        return seconds is not None and time.perf_counter() - start >= seconds
+
+    @staticmethod
+    def lines(node, codes, count):
+        """ Gets the lines of the CPT of a node matching the values of its \
+            parents in each sample
+
+        Arguments:
+            node: The node
+            codes: The code of the value of each node in each sample
+            count: Number of samples
+
+        Returns:
+            Array with the probability of each value of the node, one \
+            column per sample
+        """
+
+        index = [slice(None)]
+        for parent in node.parents["list"]:
+            index.append(codes[parent])
+
+        # the same lines for every sample when the node has no parents
+        lines = node.factor.values[tuple(index)]
+        return numpy.broadcast_to(lines.reshape(len(node.values), -1),
+                                  (len(node.values), count))
+
+    def categorical(self, probabilities):
+        """ Draws one value for each sample
+
+        Arguments:
+            probabilities: Array proportional to the probability of each \
+                value, one column per sample
+
+        Returns:
+            The codes of the values drawn
+        """
+
+        cumulative = numpy.cumsum(probabilities, axis=0)
+        draw = self.rng.random(probabilities.shape[1])
+        codes = (cumulative < draw * cumulative[-1]).sum(axis=0)
+
+        return numpy.minimum(codes, len(probabilities) - 1)
+
+    def forward(self, count):
+        """ Samples the nodes from the roots down, the evidence being fixed
+
+        Arguments:
+            count: Number of samples
+
+        Returns:
+            The code of the value of each node in each sample, and the \
+            likelihood of the evidence in each sample
+        """
+
+        codes = {}
+        for var in self.qe:
+            codes[var] = numpy.full(count, var.index[self.qe[var]])
+        weights = numpy.ones(count)
+
+        for node in self.nodes:
+            lines = Sampler.lines(node, codes, count)
+            if node in self.qe:
+                weights *= lines[codes[node][0]]
+            else:
+                codes[node] = self.categorical(lines)
+
+        return (codes, weights)
+
+
+class LikelihoodWeighting(Sampler):
+    """ Likelihood weighting: every sample fixes the evidence and is \
+        weighted by its likelihood
+    """
+
+    def draw(self, samples, seconds):
+        size = len(self.query.values)
+
+        # sums of the weights and of their squares, in total and for each
+        #value of the query
+        total = 0.0
+        squares = 0.0
+        weights = numpy.zeros(size)
+        weights_squares = numpy.zeros(size)
+
+        start = time.perf_counter()
+        while not Sampler.spent(self.samples, samples, start, seconds):
+            count = Sampler.BATCH
+            if samples is not None:
+                count = min(count, samples - self.samples)
+
+            (codes, w) = self.forward(count)
+            values = codes[self.query]
+
+            total += w.sum()
+            squares += (w * w).sum()
+            weights += numpy.bincount(values, w, size)
+            weights_squares += numpy.bincount(values, w * w, size)
+            self.samples += count
+
+        return (total, squares, weights, weights_squares)
+
+    @staticmethod
+    def estimate(query, parts):
+        total = sum(part[0] for part in parts)
+        squares = sum(part[1] for part in parts)
+        weights = sum(part[2] for part in parts)
+        weights_squares = sum(part[3] for part in parts)
+
+        probabilities = weights / total
+
+        # delta method for the ratio of the weighted sums
+        variance = (weights_squares * (1 - 2 * probabilities) +
+                    probabilities * probabilities * squares)
+        error = numpy.sqrt(numpy.maximum(variance, 0)) / total
+
+        return (Factor([query], probabilities), error)
+
+
+class Gibbs(Sampler):
+    """ Gibbs sampling: many chains in which each variable is drawn in turn \
+        given its Markov blanket, the evidence being fixed
+    """
+
+    # Sweeps of every chain discarded before counting the samples
+    BURN_IN = 100
+
+    # Largest share of the time budget spent on the sweeps discarded
+    BURN_IN_SHARE = 0.25
+
+    def draw(self, samples, seconds):
+        size = len(self.query.values)
+        chains = Sampler.BATCH
+        if samples is not None:
+            chains = max(1, min(chains, samples))
+
+        hidden = [node for node in self.nodes if node not in self.qe]
+        (codes, weights) = self.forward(chains)
+
+        # the children of each node whose CPTs were not pruned
+        children = {}
+        for node in hidden:
+            children[node] = [child for child in node.children
+                              if child in self.nodes]
+
+        counts = numpy.zeros((chains, size))
+
+        # the burn-in counts against the time budget, and is cut short so
+        #most of it is left to the samples
+        start = time.perf_counter()
+        for sweep in range(Gibbs.BURN_IN):
+            if Sampler.spent(0, None, start,
+                             seconds and seconds * Gibbs.BURN_IN_SHARE):
+                break
+            self.sweep(hidden, children, codes)
+
+        # at least one sweep is counted, so every chain has an estimate
+        sweeps = 0
+        while not sweeps or not Sampler.spent(self.samples, samples, start,
+                                              seconds):
+            self.sweep(hidden, children, codes)
+            counts[numpy.arange(chains), codes[self.query]] += 1
+            self.samples += chains
+            sweeps += 1
+
+        # the estimate of each chain
+        return counts / sweeps
+
+    def sweep(self, hidden, children, codes):
+        """ Draws every hidden variable in turn given its Markov blanket, \
+            in each chain
+
+        Arguments:
+            hidden: The hidden variables
+            children: The children of each hidden variable, except the \
+                pruned ones
+            codes: The code of the value of each node in each chain, which \
+                is updated
+        """
+
+        for node in hidden:
+            codes[node] = self.categorical(
+                Gibbs.blanket(node, children[node], codes))
+
+    @staticmethod
+    def estimate(query, parts):
+        estimates = numpy.concatenate(parts)
+        chains = len(estimates)
+
+        # the chains are independent, so the spread of their estimates
+        #gives the error of their mean
+        probabilities = estimates.mean(axis=0)
+        if chains > 1:
+            error = estimates.std(axis=0, ddof=1) / numpy.sqrt(chains)
+        else:
+            error = numpy.full(len(query.values), numpy.nan)
+
+        return (Factor([query], probabilities), error)
+
+    @staticmethod
+    def blanket(node, children, codes):
+        """ Gets the distribution of a node given its Markov blanket in \
+            each chain
+
+        Arguments:
+            node: The node
+            children: Its children, except the pruned ones
+            codes: The code of the value of each node in each chain
+
+        Returns:
+            Array with the probability of each value of the node, one \
+            column per chain
+        """
+
+        current = codes[node]
+        count = len(current)
+        probabilities = Sampler.lines(node, codes, count).copy()
+
+        for child in children:
+            for code in range(len(node.values)):
+                codes[node] = numpy.full(count, code)
+                lines = Sampler.lines(child, codes, count)
+                probabilities[code] *= lines[codes[child],
+                                             numpy.arange(count)]
+        codes[node] = current
+
+        # a chain in which no value is possible is left where it is
+        total = probabilities.sum(axis=0)
+        stuck = total == 0
+        probabilities[:, stuck] = 0
+        probabilities[current[stuck], numpy.flatnonzero(stuck)] = 1
+
+        return probabilities
+
+
+# Sampling engines that can be used instead of variable elimination
+ENGINES = {
+    "likelihood-weighting": LikelihoodWeighting,
+    "gibbs": Gibbs
+}
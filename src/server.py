@@ -0,0 +1,296 @@
+#!/usr/bin/python3
+""" Inference server
+
+Answers queries sent as JSON lines, one per line, keeping the networks
+loaded between them:
+
+    {"network": "net.bn", "query": "B", "evidence": {"J": "T", "M": "T"}}
+
+The query can also be a list of variables, whose joint distribution is
+given with the values of the variables separated by spaces.
+
+Each answer is a JSON line with the distribution of the query variable,
+or with the error raised by the query, and the id of the request if it
+had one.
+
+The clients of a local socket are answered by a pool of processes, each
+one keeping its own networks loaded, so a long query does not hold up the
+others.
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import os
+import stat
+import sys
+
+from bayes import BayesN
+from cache import FactorCache, Fingerprint, ResultCache
+from errors import VEFactorTooLarge
+from ordering import ORDERINGS
+from qe import QandE
+from run import ArgParser
+from ve import VE, Rejection
+
+
+# Server of a worker process of the pool answering the clients
+WORKER = {}
+
+
+class Registry(object):
+    """ Networks loaded by the server, each file being loaded again when \
+        its contents change
+
+    Attributes:
+        cache_size(int): Maximum number of results kept for each network.
+        memo(int): Bytes of factors made by summing out hidden variables \
+            kept for each network, 0 to disable.
+        files(dict): Modification time and size of each file, and the \
+            fingerprint of its contents when they were last read.
+        networks(dict): The BayesN, ResultCache and FactorCache of each \
+            fingerprint, files with the same contents sharing them.
+    """
+
+    def __init__(self, cache_size=1024, memo=0):
+        self.cache_size = cache_size
+        self.memo = memo
+        self.files = {}
+        self.networks = {}
+
+    def get(self, filename):
+        """ Gets a network, loading it if the file is new or was changed
+
+        Arguments:
+            filename: The .bn or .bnc file
+
+        Returns:
+            A dictionary with the BayesN, ResultCache and FactorCache of \
+            the network
+        """
+
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        # the file is only hashed again when it seems to have changed
+        if path in self.files and self.files[path][0] == signature:
+            return self.networks[self.files[path][1]]
+
+        fingerprint = Fingerprint(path)
+        if fingerprint not in self.networks:
+            logging.info("Loading {}".format(path))
+            self.networks[fingerprint] = {
+                "bn": BayesN(path),
+                "cache": ResultCache(fingerprint, self.cache_size),
+                "memo": FactorCache(self.memo) if self.memo > 0 else None
+            }
+
+        old = self.files.get(path)
+        self.files[path] = (signature, fingerprint)
+
+        # the previous contents are dropped once no file has them
+        if old and old[1] not in [f[1] for f in self.files.values()]:
+            del self.networks[old[1]]
+
+        return self.networks[fingerprint]
+
+
+class Server(object):
+    """ Answers the queries of the clients on the networks of a registry
+
+    Attributes:
+        registry: The Registry with the networks.
+        ordering: Function giving the elimination order.
+        max_size: Maximum number of lines of a factor, None for no limit.
+        jobs: Number of processes answering the clients of a socket.
+    """
+
+    def __init__(self, registry, ordering=None, max_size=None, jobs=1):
+        self.registry = registry
+        self.ordering = ordering
+        self.max_size = max_size
+        self.jobs = jobs
+
+    def answer(self, line):
+        """ Answers one request
+
+        Arguments:
+            line: The request, as a JSON line
+
+        Returns:
+            The answer, as a JSON line
+        """
+
+        answer = {}
+        try:
+            request = json.loads(line)
+            if "id" in request:
+                answer["id"] = request["id"]
+
+            network = self.registry.get(request["network"])
+
+            # the query goes through the same checks as the .in files
+            qe = QandE()
+            names = request["query"]
+            if not isinstance(names, list):
+                names = [names]
+            qe.parse_line(["QUERY"] + names)
+            evidence = request.get("evidence", {})
+            if evidence:
+                elements = ["EVIDENCE", str(len(evidence))]
+                for name in evidence:
+                    elements += [name, evidence[name]]
+                qe.parse_line(elements)
+
+            distrib = VE.batch(network["bn"].nodes, [qe], False,
+                               self.ordering, 1, network["cache"],
+                               network["memo"], max_size=self.max_size)[0]
+            if isinstance(distrib, Rejection):
+                raise VEFactorTooLarge(distrib.size, distrib.limit)
+
+            answer["query"] = " ".join(qe.query)
+            answer["evidence"] = qe.evidence
+            answer["dist"] = {}
+            for row in distrib.result.table:
+                values = row[:max(1, len(row) - 1)]
+                answer["dist"][" ".join(str(v) for v in values)] = row[-1]
+        except Exception as error:
+            answer["error"] = "{}: {}".format(type(error).__name__, error)
+
+        return json.dumps(answer)
+
+    @staticmethod
+    def init_worker(server):
+        """ Keeps the server in a worker process of the pool, with the \
+            networks it loads
+
+        Arguments:
+            server: The Server, its registry being empty
+        """
+
+        WORKER["server"] = server
+
+    @staticmethod
+    def answer_worker(line):
+        """ Answers one request in a worker process of the pool
+
+        Arguments:
+            line: The request, as a JSON line
+
+        Returns:
+            The answer, as a JSON line
+        """
+
+        return WORKER["server"].answer(line)
+
+    async def handle(self, pool, reader, writer):
+        """ Answers the requests of a client until it disconnects
+
+        Arguments:
+            pool: The ProcessPoolExecutor answering the requests
+            reader: Stream with the requests
+            writer: Stream where the answers are written to
+        """
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+
+            answer = await loop.run_in_executor(pool, Server.answer_worker,
+                                                line)
+            writer.write((answer + "\n").encode())
+            await writer.drain()
+
+        writer.close()
+
+    async def serve(self, path):
+        """ Accepts clients on a local socket until the server is stopped, \
+            removing the socket then
+
+        Arguments:
+            path: File of the socket
+        """
+
+        with ProcessPoolExecutor(self.jobs, initializer=Server.init_worker,
+                                 initargs=(self,)) as pool:
+            server = await asyncio.start_unix_server(
+                lambda reader, writer: self.handle(pool, reader, writer),
+                path)
+
+            # the file is only removed once the socket is bound to it, and
+            #only if it is still a socket
+            try:
+                async with server:
+                    await server.serve_forever()
+            finally:
+                if (os.path.lexists(path) and
+                        stat.S_ISSOCK(os.lstat(path).st_mode)):
+                    os.remove(path)
+
+    def serve_stdin(self):
+        """ Answers the requests read from the standard input, writing the \
+            answers to the standard output
+        """
+
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+
+            sys.stdout.write(self.answer(line) + "\n")
+            sys.stdout.flush()
+
+
+def main():
+    """ Main function of the server.
+
+    Answers the requests of the standard input, or the ones of the clients
+    of a local socket.
+    """
+
+    parser = ArgParser(description="", epilog="")
+    parser.add_argument("-s", "--socket",
+                        help="file of the local socket on which the \
+                            clients connect (instead of the console)")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="maximum number of results kept for each \
+                            network")
+    parser.add_argument("-m", "--memo", type=float, default=64,
+                        help="megabytes of factors made by summing out \
+                            hidden variables kept for each network (0 to \
+                            disable)")
+    parser.add_argument("-o", "--order", default="topological",
+                        choices=["topological"] + sorted(ORDERINGS),
+                        help="order in which the hidden variables are \
+                            eliminated")
+    parser.add_argument("--max-factor-size", type=int, default=0,
+                        help="maximum number of lines of a factor, another \
+                            order being used or the query rejected when \
+                            the order given would exceed it (0 for no limit)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of processes answering the clients of \
+                            the socket, each one loading the networks")
+
+    args = parser.parse_args()
+
+    server = Server(Registry(args.cache_size, int(args.memo * 2**20)),
+                    ORDERINGS.get(args.order), args.max_factor_size or None,
+                    args.jobs)
+
+    if args.socket:
+        try:
+            asyncio.run(server.serve(args.socket))
+        except KeyboardInterrupt:
+            pass
+    else:
+        server.serve_stdin()
+
+
+if __name__ == '__main__':
+    main()
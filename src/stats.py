@@ -0,0 +1,157 @@
+""" Profiling of the VE algorithm
+"""
+
+import time
+
+
+class Stats(object):
+    """ Time and work spent by the VE algorithm on the queries it is given
+
+    The products of the factors and their sums are timed together as
+    sum_product when the variables are eliminated without logging each step.
+
+    Attributes:
+        queries(int): Number of queries solved.
+        seconds(dict): Time spent in each phase.
+        calls(dict): Number of calls of each phase.
+        peak_rows(int): Number of lines of the largest factor built.
+        peak_width(int): Number of variables of the widest factor built.
+        comparisons(int): Number of lines of the factors matched by the \
+            products, each line of a product matching one of every factor.
+        variables(dict): Number of eliminations, time taken and number of \
+            lines of the largest product of each hidden variable.
+    """
+
+    # Phases whose factors are multiplied, the factors being the last argument
+    JOINS = ("pointwise_product", "sum_product")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = {}
+        self.calls = {}
+        self.peak_rows = 0
+        self.peak_width = 0
+        self.comparisons = 0
+        self.variables = {}
+
+    @staticmethod
+    def untimed(phase, function, *args):
+        """ Calls the function of a phase when not profiling
+        """
+
+        return function(*args)
+
+    def call(self, phase, function, *args):
+        """ Calls the function of a phase, adding its time and the factors \
+            it builds to the stats
+
+        Arguments:
+            phase: The phase
+            function: The function
+            args: The arguments of the function
+
+        Returns:
+            The result of the function, a factor or a list of factors
+        """
+
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = time.perf_counter() - start
+
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+
+        if phase in self.JOINS and len(args[-1]) > 1:
+            self.comparisons += Stats.rows(args[-1]) * len(args[-1])
+
+        for factor in result if isinstance(result, list) else [result]:
+            self.peak_rows = max(self.peak_rows, factor.values.size)
+            self.peak_width = max(self.peak_width, len(factor.table_header))
+
+        return result
+
+    def eliminated(self, variable, factors, seconds):
+        """ Adds the elimination of a hidden variable to the stats
+
+        Arguments:
+            variable: The variable
+            factors: The factors that mention it
+            seconds: Time taken to sum it out of their product
+        """
+
+        if variable.name not in self.variables:
+            self.variables[variable.name] = {
+                "eliminations": 0,
+                "seconds": 0.0,
+                "rows": 0
+            }
+
+        cost = self.variables[variable.name]
+        cost["eliminations"] += 1
+        cost["seconds"] += seconds
+        cost["rows"] = max(cost["rows"], Stats.rows(factors))
+
+    def merge(self, other):
+        """ Adds the stats of other queries, such as the ones solved by \
+            another process
+
+        Arguments:
+            other: The other Stats
+        """
+
+        self.queries += other.queries
+        for phase in other.seconds:
+            self.seconds[phase] = (self.seconds.get(phase, 0.0) +
+                                   other.seconds[phase])
+            self.calls[phase] = self.calls.get(phase, 0) + other.calls[phase]
+        self.peak_rows = max(self.peak_rows, other.peak_rows)
+        self.peak_width = max(self.peak_width, other.peak_width)
+        self.comparisons += other.comparisons
+
+        for (name, cost) in other.variables.items():
+            if name not in self.variables:
+                self.variables[name] = dict(cost)
+                continue
+            mine = self.variables[name]
+            mine["eliminations"] += cost["eliminations"]
+            mine["seconds"] += cost["seconds"]
+            mine["rows"] = max(mine["rows"], cost["rows"])
+
+    def report(self):
+        """ Gets the stats as plain data, to be written as JSON
+
+        Returns:
+            A dictionary with the stats
+        """
+
+        return {
+            "queries": self.queries,
+            "phases": dict((phase, {"calls": self.calls[phase],
+                                    "seconds": self.seconds[phase]})
+                           for phase in self.seconds),
+            "peak_rows": self.peak_rows,
+            "peak_width": self.peak_width,
+            "comparisons": self.comparisons,
+            "variables": self.variables
+        }
+
+    @staticmethod
+    def rows(factors):
+        """ Number of lines of the product of some factors
+
+        Arguments:
+            factors: The factors
+
+        Returns:
+            The number of lines
+        """
+
+        variables = set()
+        for factor in factors:
+            variables.update(factor.table_header)
+
+        rows = 1
+        for var in variables:
+            rows *= len(var.values)
+
+        return rows
@@ -1,8 +1,124 @@
 """ VE Algorithm
 """
 
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+import logging
+import time
+
+import numpy
+
 from errors import *
-from bayes import Variable
+from factor import Factor
+from ordering import ORDERINGS, elimination_plan, max_factor_size
+from pruning import relevant_nodes
+from stats import Stats
+
+
+# State of a worker process of a parallel batch
+WORKER = {}
+
+
+class Solution(object):
+    """ Result of a query answered in another process
+
+    Attributes:
+        result: The result of the algorithm.
+        log: The log array.
+    """
+
+    def __init__(self, result, log):
+        self.result = result
+        self.log = log
+
+
+class Rejection(object):
+    """ Query rejected because every elimination order builds a factor \
+        larger than the limit
+
+    Attributes:
+        size: Number of lines of the largest factor of the best order.
+        limit: Maximum number of lines of a factor.
+        log: The log array, always empty.
+    """
+
+    def __init__(self, size, limit):
+        self.size = size
+        self.limit = limit
+        self.log = []
+
+
+class Explanation(object):
+    """ Most probable values of some variables given the evidence
+
+    Attributes:
+        assignment: Each variable with its value, in the order of the query.
+        probability: The probability of the assignment given the evidence.
+        log: The log array, always empty.
+    """
+
+    def __init__(self, assignment, probability):
+        self.assignment = assignment
+        self.probability = probability
+        self.log = []
+
+
+class StepLog(object):
+    """ Trace of the steps of the VE algorithm, kept as structured events \
+        and only written out as the lines of the log when asked
+
+    It is called with the name of each event and its arguments:
+        ("added", node, factors): The CPT of a node was added to the factors
+        ("eliminated", variable, product, header): A hidden variable was
+            summed out of the product of the factors that mention it, which
+            is written with its variables in the order of the header
+        ("end", factors): Every variable was processed
+        ("product", factor): The remaining factors were multiplied
+        ("normalized", factor): The result of the algorithm
+
+    Attributes:
+        events: The events, in the order they happened.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event, *args):
+        self.events.append((event, args))
+
+    def lines(self):
+        """ Writes out the log
+
+        Returns:
+            The log array
+        """
+
+        log = []
+        for (event, args) in self.events:
+            if event == "added":
+                (node, factors) = args
+                log.append("Added {} to the factors".format(node.name))
+                log.append("Factors are now:")
+                for factor in factors:
+                    VE.write_table_log(log, factor)
+            elif event == "eliminated":
+                (variable, PwP, header) = args
+                log.append("The variable {} is not in the query nor in the evidence".format(variable.name))
+                log.append("The pointwise product of the factors results in:")
+                VE.write_table_log(log, PwP, header)
+                log.append("These were summed out")
+            elif event == "end":
+                log.append("Factors are in the end:")
+                for factor in args[0]:
+                    VE.write_table_log(log, factor)
+            elif event == "product":
+                log.append("The pointwise product of the factors results in:")
+                VE.write_table_log(log, args[0])
+            elif event == "normalized":
+                log.append("Which finally, normalizing the probabilities, result in:")
+                VE.write_table_log(log, args[0])
+
+        return log
 
 
 class VE(object):
@@ -11,104 +127,654 @@ class VE(object):
     Attributes:
         bn: The beysian network on which to perform the algorithm.
         qe: The dictionary containing the evidence.
-        query: The query.
+        query: The query variables.
+        order: The order in which the variables are processed.
+        max_factor_size: Predicted number of lines of the largest factor, \
+            None unless there is a limit or it is logged.
         result: The result of the algorithm.
-        log: The log array.
+        steps: The StepLog of the algorithm, or None when not verbose.
     """
 
-    def __init__(self, bn, qe, verbose):
+    def __init__(self, bn, qe, verbose, ordering=None, reduced=None,
+                 memo=None, stats=None, max_size=None):
         self.bn = bn
-        self.qe = {}
-
-        # Transform the name of the query variable into an actual reference
-        self.query = bn["dict"][qe.query]
 
         # Transform the names in the evidence into actual references
-        for e in qe.evidence:
-            self.qe[bn["dict"][e]] = qe.evidence[e]
+        self.qe = VE.resolve_evidence(bn, qe.evidence)
+
+        # Transform the names of the query variables into actual references
+        self.query = VE.resolve_query(bn, qe.query, self.qe)
+
+        # Only the nodes relevant to the query take part in the algorithm
+        nodes = relevant_nodes(self.bn["list"], self.query, self.qe)
+
+        if ordering:
+            self.order = ordering(nodes, self.query, self.qe)
+        else:
+            self.order = VE.sort_nodes(nodes)
+
+        # the prediction simulates the whole elimination, so it is only
+        #made when it is needed
+        self.max_factor_size = None
+        if max_size or logging.getLogger().isEnabledFor(logging.INFO):
+            self.max_factor_size = max_factor_size(
+                nodes, self.order, self.query, self.qe)
+            logging.info("Predicted maximum factor size: {}".format(
+                self.max_factor_size))
+
+        if max_size and self.max_factor_size > max_size:
+            # another heuristic may keep every factor within the limit
+            for name in sorted(ORDERINGS):
+                order = ORDERINGS[name](nodes, self.query, self.qe)
+                size = max_factor_size(nodes, order, self.query, self.qe)
+                if size < self.max_factor_size:
+                    (self.order, self.max_factor_size) = (order, size)
+
+            if self.max_factor_size > max_size:
+                raise VEFactorTooLarge(self.max_factor_size, max_size)
+            logging.warning("Order changed to keep the factors within {} "
+                            "lines".format(max_size))
+
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            for (variable, scope, lines) in elimination_plan(
+                    nodes, self.order, self.query, self.qe):
+                logging.debug("Eliminating {} builds {} lines over {}".format(
+                    variable.name, lines,
+                    " ".join(var.name for var in scope)))
+
+        (self.result, self.steps) = VE.elimination_ask(
+            self.query, self.qe, self.bn, verbose, self.order, reduced, memo,
+            stats=stats)
+
+    @property
+    def log(self):
+        """ The log array, empty when not verbose
+        """
+
+        if self.steps is None:
+            return []
+
+        return self.steps.lines()
+
+    @staticmethod
+    def resolve_evidence(bn, evidence):
+        """ Transforms the names in the evidence into actual references
+
+        Arguments:
+            bn: Belief network
+            evidence: Dictionary with the value of each evidence name
+
+        Returns:
+            The evidence specified as an event
+        """
+
+        e = {}
+        for name in evidence:
+            e[bn["dict"][name]] = evidence[name]
+
+        return e
+
+    @staticmethod
+    def resolve_query(bn, names, e):
+        """ Transforms the names of the query variables into actual \
+            references
+
+        Arguments:
+            bn: Belief network
+            names: The names of the query variables
+            e: Evidence specified as an event
+
+        Returns:
+            The query variables
+        """
+
+        query = [bn["dict"][name] for name in names]
+
+        # a variable named twice, maybe through its alias, does not make a
+        #query
+        if len(set(query)) != len(query):
+            raise QEMalformedQuery
+
+        return query
+
+    @staticmethod
+    def batch(bn, queries, verbose, ordering=None, jobs=1, cache=None,
+              memo=None, stats=None, max_size=None):
+        """ Answers several queries on the same network, the ones with the \
+            same evidence sharing the CPTs without that evidence
+
+        Arguments:
+            bn: Belief network
+            queries: The QandE objects with the queries
+            verbose: Whether or not to log each step
+            ordering: Function giving the elimination order
+            jobs: Number of processes among which to split the queries
+            cache: Optional ResultCache with the known results, not used \
+                when logging each step
+            memo: Optional FactorCache to share the factors made by \
+                summing out hidden variables, each process having its own
+            stats: Optional Stats to which the work of the queries solved, \
+                and not taken from the cache, is added
+            max_size: Optional maximum number of lines of a factor, the \
+                queries for which no order keeps to it being answered with \
+                a Rejection
+
+        Returns:
+            The results, one per query and in the same order
+        """
+
+        distribs = [None for qe in queries]
+
+        # the queries to solve, each repeated query being solved once, the
+        #MAP queries being answered without the cache
+        keys = {}
+        if cache and not verbose:
+            unsolved = []
+            for n in range(len(queries)):
+                if queries[n].map is not None:
+                    unsolved.append(n)
+                    continue
+                key = cache.key(bn, queries[n])
+                result = cache.get(bn, key)
+                if result is not None:
+                    distribs[n] = Solution(result, [])
+                elif key in keys:
+                    keys[key].append(n)
+                else:
+                    keys[key] = [n]
+            unsolved = sorted(unsolved + [keys[key][0] for key in keys])
+        else:
+            unsolved = list(range(len(queries)))
+
+        if jobs > 1:
+            # the network is sent once to each process, not with every query
+            with ProcessPoolExecutor(jobs, initializer=VE.init_worker,
+                                     initargs=(bn, verbose, ordering, memo,
+                                               stats is not None,
+                                               max_size)) as ex:
+                answers = list(ex.map(
+                    VE.solve_worker, [queries[n] for n in unsolved],
+                    chunksize=max(1, len(unsolved) // (4 * jobs))))
+
+            for (n, (answer, worked)) in zip(unsolved, answers):
+                # the names are turned back into the variables of this
+                #process
+                if isinstance(answer, Solution):
+                    answer.result.table_header = [
+                        bn["dict"][name]
+                        for name in answer.result.table_header]
+                elif isinstance(answer, Explanation):
+                    answer.assignment = [(bn["dict"][name], value)
+                                         for (name, value)
+                                         in answer.assignment]
+                distribs[n] = answer
+                if stats is not None:
+                    stats.merge(worked)
+        else:
+            # CPTs without the evidence, for each set of evidence
+            reduced = {}
+
+            for n in unsolved:
+                try:
+                    if queries[n].map is None:
+                        distribs[n] = VE.solve(bn, queries[n], verbose,
+                                               ordering, reduced, memo, stats,
+                                               max_size)
+                    else:
+                        distribs[n] = VE.explain(bn, queries[n], ordering,
+                                                 stats, max_size)
+                except VEFactorTooLarge as error:
+                    distribs[n] = Rejection(error.size, error.limit)
+
+        for key in keys:
+            # a rejection is not kept, another limit may allow the query
+            if not isinstance(distribs[keys[key][0]], Rejection):
+                cache.put(key, distribs[keys[key][0]].result)
+            for n in keys[key][1:]:
+                distribs[n] = distribs[keys[key][0]]
+
+        return distribs
+
+    @staticmethod
+    def solve(bn, qe, verbose, ordering, reduced, memo=None, stats=None,
+              max_size=None):
+        """ Answers a query, reusing the CPTs without the same evidence
+
+        Arguments:
+            bn: Belief network
+            qe: The QandE object with the query
+            verbose: Whether or not to log each step
+            ordering: Function giving the elimination order
+            reduced: Dictionary with the CPTs without the evidence of each \
+                set of evidence, filled in as they are made
+            memo: Optional FactorCache with the factors made by summing \
+                out hidden variables
+            stats: Optional Stats to which the work of the query is added
+            max_size: Optional maximum number of lines of a factor
+
+        Returns:
+            The VE object with the result
+        """
+
+        key = frozenset(VE.resolve_evidence(bn, qe.evidence).items())
+        if key not in reduced:
+            reduced[key] = {}
+
+        return VE(bn, qe, verbose, ordering, reduced[key], memo, stats,
+                  max_size)
+
+    @staticmethod
+    def init_worker(bn, verbose, ordering, memo, profile=False,
+                    max_size=None):
+        """ Keeps the network in a worker process of a parallel batch
+
+        Arguments:
+            bn: Belief network
+            verbose: Whether or not to log each step
+            ordering: Function giving the elimination order
+            memo: Optional FactorCache of the process
+            profile: Whether or not to return the Stats of each query
+            max_size: Optional maximum number of lines of a factor
+        """
+
+        WORKER["bn"] = bn
+        WORKER["verbose"] = verbose
+        WORKER["ordering"] = ordering
+        WORKER["reduced"] = {}
+        WORKER["memo"] = memo
+        WORKER["profile"] = profile
+        WORKER["max_size"] = max_size
+
+    @staticmethod
+    def solve_worker(qe):
+        """ Answers a query in a worker process of a parallel batch
+
+        Arguments:
+            qe: The QandE object with the query
+
+        Returns:
+            The Solution, Explanation or Rejection of the query, with the \
+            names of the variables instead of the variables themselves, \
+            which belong to the worker, and the Stats of the query or None
+        """
+
+        stats = Stats() if WORKER["profile"] else None
+        try:
+            if qe.map is None:
+                ve = VE.solve(WORKER["bn"], qe, WORKER["verbose"],
+                              WORKER["ordering"], WORKER["reduced"],
+                              WORKER["memo"], stats, WORKER["max_size"])
+                answer = Solution(
+                    Factor([var.name for var in ve.result.table_header],
+                           ve.result.values), ve.log)
+            else:
+                explanation = VE.explain(WORKER["bn"], qe, WORKER["ordering"],
+                                         stats, WORKER["max_size"])
+                answer = Explanation(
+                    [(var.name, value)
+                     for (var, value) in explanation.assignment],
+                    explanation.probability)
+        except VEFactorTooLarge as error:
+            answer = Rejection(error.size, error.limit)
 
-        (self.result, self.log) = VE.elimination_ask(self.query, self.qe, self.bn, verbose)
+        return (answer, stats)
 
     @staticmethod
-    def elimination_ask(X, e, bn, verbose=False):
+    def elimination_ask(X, e, bn, verbose=False, variables=None,
+                        reduced=None, memo=None, trace=None, stats=None):
         """ Variable elimination algorithm
 
         Arguments:
-            X: Query variable
+            X: Query variables, kept in the result in the same order
             e: Evidence specified as an event
             bn: Belief network
+            verbose: Whether or not to keep a StepLog when no trace is given
+            variables: The nodes to process, in order. If not given, the \
+                nodes relevant to the query, from leaf to root
+            reduced: Optional dictionary with the factor of each node \
+                without the evidence, filled in as the factors are made
+            memo: Optional FactorCache with the factors made by summing \
+                out the hidden variables, not used when tracing each step
+            trace: Optional function called with each step, as a StepLog
+            stats: Optional Stats to which the work of the query is added
         Returns:
-            The probability P(X|e)
+            The probability P(X|e) and the trace, None when not verbose
         """
 
-        log = []
+        if verbose and trace is None:
+            trace = StepLog()
+        if trace is not None:
+            memo = None
+
+        # every phase goes through call, which only times it when profiling
+        if stats is None:
+            call = Stats.untimed
+        else:
+            call = stats.call
+            stats.queries += 1
 
         factors = []
-        variables = VE.sort_nodes(bn["list"])
 
-        for variable in variables:
-            factors.append(VE.make_factors(variable, e))
-            if verbose:
-                log.append("Added {} to the factors".format(variable.name))
-                log.append("Factors are now:")
+        # number standing for the key of each factor in the memo
+        origins = {}
+        if variables is None:
+            variables = VE.sort_nodes(relevant_nodes(bn["list"], X, e))
 
-                for factor in factors:
-                    VE.write_table_log(log, factor)
+        # nodes whose CPT was not yet added to the factors, which are added
+        #in the order they are processed
+        pending = set(variables)
+        position = dict((node, i) for (i, node) in enumerate(variables))
 
+        for variable in variables:
+            # every factor that mentions the variable must be present by the
+            #time it is eliminated: its own CPT and the ones of its children
+            added = [variable] + sorted(
+                [child for child in variable.children if child in pending],
+                key=position.get)
+            for node in added:
+                if node not in pending:
+                    continue
+                pending.remove(node)
+
+                if reduced is None:
+                    factors.append(call("make_factors", VE.make_factors,
+                                        node, e))
+                else:
+                    if node not in reduced:
+                        reduced[node] = call("make_factors", VE.make_factors,
+                                             node, e)
+                    factors.append(reduced[node])
+                if memo is not None:
+                    origins[id(factors[-1])] = memo.intern(
+                        VE.cpt_key(node, e))
+                if trace is not None:
+                    trace("added", node, list(factors))
 
             # check if variable is hidden
-            if variable != X and variable not in e:
-                PwP = VE.pointwise_product(factors)
-                if verbose:
-                    log.append("The variable {} is not in the query nor in the evidence".format(variable.name))
-                    log.append("The pointwise product of the factors results in:")
-                    VE.write_table_log(log, PwP)
-                    log.append("These were summed out")
-                factors = VE.sum_out(variable, PwP)
-
-        log.append("Factors are in the end:")
+            if variable not in X and variable not in e:
+                # only the factors that mention the variable are involved
+                involved = [f for f in factors if variable in f.table_header]
+                factors = [f for f in factors
+                           if variable not in f.table_header]
+                if stats is not None:
+                    start = time.perf_counter()
+
+                if trace is not None:
+                    PwP = call("pointwise_product", VE.pointwise_product,
+                               involved)
+                    trace("eliminated", variable, PwP,
+                          VE.logged_header(involved))
+                    factors += call("sum_out", VE.sum_out, variable, PwP)
+                elif memo is None:
+                    factors += call("sum_product", VE.sum_product, variable,
+                                    involved)
+                else:
+                    # the factor is determined by the variable and the
+                    #factors it is summed out of
+                    key = (variable, frozenset(origins[id(f)]
+                                               for f in involved))
+                    number = memo.intern(key)
+
+                    summed = memo.get(key)
+                    if summed is None:
+                        summed = call("sum_product", VE.sum_product,
+                                      variable, involved)[0]
+                        memo.put(key, summed)
+
+                    origins[id(summed)] = number
+                    factors.append(summed)
+
+                if stats is not None:
+                    stats.eliminated(variable, involved,
+                                     time.perf_counter() - start)
+
+        PwP = call("pointwise_product", VE.pointwise_product, factors)
+
+        # the joint distribution follows the order of the query, the query
+        #variables that are evidence taking their value for sure
+        certain = []
+        for var in X:
+            if var in e:
+                indicator = numpy.zeros(len(var.values))
+                indicator[var.index[e[var]]] = 1
+                certain.append(Factor([var], indicator))
+        if PwP.table_header != X or certain:
+            PwP = Factor.product([PwP] + certain, X)
+        normalized = call("normalize", VE.normalize, PwP)
+        if trace is not None:
+            trace("end", factors)
+            trace("product", PwP)
+            trace("normalized", normalized)
+        return (normalized, trace)
+
+    @staticmethod
+    def explain(bn, qe, ordering=None, stats=None, max_size=None):
+        """ Finds the most probable values of the MAP variables of a query \
+            given its evidence
+
+        Arguments:
+            bn: Belief network
+            qe: The QandE object with the MAP query
+            ordering: Function giving the elimination order
+            stats: Optional Stats to which the work of the query is added
+            max_size: Optional maximum number of lines of a factor, \
+                VEFactorTooLarge being raised when no order keeps to it
+
+        Returns:
+            The Explanation with the assignment
+        """
+
+        e = VE.resolve_evidence(bn, qe.evidence)
+        if qe.map:
+            M = [bn["dict"][name] for name in qe.map]
+        else:
+            M = [node for node in bn["list"] if node not in e]
+
+        nodes = relevant_nodes(bn["list"], M, e)
+        if ordering:
+            order = VE.map_order(ordering(nodes, [], e), M)
+        else:
+            order = VE.map_order(VE.sort_nodes(nodes), M)
+
+        # every variable is eliminated, the MAP ones being maximized
+        if max_size:
+            size = max_factor_size(nodes, order, [], e)
+        if max_size and size > max_size:
+            for name in sorted(ORDERINGS):
+                other = VE.map_order(ORDERINGS[name](nodes, [], e), M)
+                other_size = max_factor_size(nodes, other, [], e)
+                if other_size < size:
+                    (order, size) = (other, other_size)
+
+            if size > max_size:
+                raise VEFactorTooLarge(size, max_size)
+            logging.warning("Order changed to keep the factors within {} "
+                            "lines".format(max_size))
+
+        if stats is None:
+            call = Stats.untimed
+        else:
+            call = stats.call
+            stats.queries += 1
+
+        (joint, pointers) = VE.max_elimination(e, order, M, call)
+        (evidence, unused) = VE.max_elimination(e, order, [], call)
+
+        # each back-pointer depends on the variables maximized after it
+        codes = {}
+        for (variable, table_header, argmax) in reversed(pointers):
+            codes[variable] = int(argmax[tuple(codes[var]
+                                               for var in table_header)])
+
+        assignment = []
+        for var in M:
+            if var in e:
+                assignment.append((var, e[var]))
+            else:
+                assignment.append((var, var.values[codes[var]]))
+
+        return Explanation(assignment, joint / evidence)
+
+    @staticmethod
+    def map_order(order, M):
+        """ Moves the MAP variables to the end of an elimination order, so \
+            the back-pointers only depend on the MAP variables
+
+        Arguments:
+            order: The elimination order
+            M: The MAP variables
+
+        Returns:
+            The order with the other variables summed out first
+        """
+
+        return ([var for var in order if var not in M] +
+                [var for var in order if var in M])
+
+    @staticmethod
+    def max_elimination(e, variables, maxed, call=Stats.untimed):
+        """ Variable elimination maximizing some variables instead of \
+            summing them out
+
+        Arguments:
+            e: Evidence specified as an event
+            variables: The nodes to process, in order, every variable \
+                summed out going before the maximized ones
+            maxed: The variables to maximize
+            call: Function through which every phase is called, which \
+                times it when profiling
+
+        Returns:
+            The largest probability of the maximized variables and the \
+            evidence, and the back-pointer of each maximized variable
+        """
+
+        factors = []
+        pointers = []
+
+        # nodes whose CPT was not yet added to the factors
+        pending = set(variables)
+        position = dict((node, i) for (i, node) in enumerate(variables))
+
+        for variable in variables:
+            added = [variable] + sorted(
+                [child for child in variable.children if child in pending],
+                key=position.get)
+            for node in added:
+                if node in pending:
+                    pending.remove(node)
+                    factors.append(call("make_factors", VE.make_factors,
+                                        node, e))
+
+            if variable in e:
+                continue
+
+            involved = [f for f in factors if variable in f.table_header]
+            factors = [f for f in factors if variable not in f.table_header]
+
+            if variable in maxed:
+                (maximized, pointer) = VE.max_out(
+                    variable, call("pointwise_product", VE.pointwise_product,
+                                   involved))
+                factors.append(maximized)
+                pointers.append(pointer)
+            else:
+                factors += call("sum_product", VE.sum_product, variable,
+                                involved)
+
+        # only factors without variables are left
+        probability = 1.0
         for factor in factors:
-            factor_log = ""
-            for fac_var in factor.table_header:
-                factor_log += "{} ".format(fac_var.name)
-            log.append(factor_log)
-
-            for line in factor.table:
-                log_line = ""
-                for col in line:
-                    log_line += "{} ".format(str(col))
-                log.append(log_line)
-
-        PwP = VE.pointwise_product(factors)
-        if verbose:
-            log.append("The pointwise product of the factors results in:")
-            VE.write_table_log(log, PwP)
-        normalized = VE.normalize(PwP)
-        if verbose:
-            log.append("Which finally, normalizing the probabilities, result in:")
-            VE.write_table_log(log, normalized)
-        return (normalized, log)
+            probability *= float(factor.values)
+
+        return (probability, pointers)
+
+    @staticmethod
+    def max_out(variable, PwP):
+        """ Removes the axis of the given variable, keeping the largest \
+            probability along it and the value it belongs to
+
+        Arguments:
+            variable: Variable to remove
+            PwP: Factor on which to perform the removal
+
+        Returns:
+            The new factor without the variable, and the back-pointer with \
+            the variable, the variables of the new factor and the code of \
+            the best value of the variable for each line of the new factor
+        """
+
+        table_header = list(PwP.table_header)
+        axis = table_header.index(variable)
+        table_header.remove(variable)
+
+        return (Factor(table_header, PwP.values.max(axis=axis)),
+                (variable, table_header, PwP.values.argmax(axis=axis)))
+
+    @staticmethod
+    def cpt_key(node, e):
+        """ Builds the key in the memo of the CPT of a node without the \
+            evidence
+
+        Arguments:
+            node: The node
+            e: Evidence specified as an event
+
+        Returns:
+            The node and the evidence on each of its variables, which \
+            together determine the factor
+        """
+
+        return (node, tuple(e.get(var) for var in node.table_header))
 
     @staticmethod
-    def write_table_log(log, node):
+    def write_table_log(log, node, header=None):
         """ Writes one CPT to the log array
 
         Arguments:
             log: The log array
             node: The node that contains the CPT
+            header: Optional order in which to write the variables, the \
+                lines keeping their order
         """
 
+        if header is None:
+            header = node.table_header
+        columns = [node.table_header.index(var) for var in header]
+
         factor_log = ""
-        for fac_var in node.table_header:
+        for fac_var in header:
             factor_log += "{} ".format(fac_var.name)
         log.append(factor_log)
 
         for line in node.table:
             log_line = ""
-            for col in line:
+            for col in [line[i] for i in columns] + [line[-1]]:
                 log_line += "{} ".format(str(col))
             log.append(log_line)
 
+    @staticmethod
+    def logged_header(factors):
+        """ Gets the order in which the variables of a product are logged, \
+            the one of multiplying the factors two at a time: the common \
+            variables first, then the ones only in the product so far and \
+            then the ones only in the next factor
+
+        Arguments:
+            factors: The factors of the product
+
+        Returns:
+            The variables of the product
+        """
+
+        header = list(factors[0].table_header)
+        for f in factors[1:]:
+            common = [var for var in header if var in f.table_header]
+            header = (common + [var for var in header if var not in common] +
+                      [var for var in f.table_header if var not in common])
+
+        return header
+
     @staticmethod
     def sort_nodes(bn):
         """ Sort the nodes from leaf to root
@@ -121,17 +787,38 @@ class VE(object):
         """
 
         lsorted = []
-
-        while True:
-            done = True
-            for node in bn:
-                if (not node.children and node not in lsorted):
-                    lsorted.append(node)
-                    for parent in node.parents["list"]:
-                        parent.children.remove(node)
-                    done = False
-            if done:
-                break
+        position = dict((node, i) for (i, node) in enumerate(bn))
+
+        # a node is a leaf once all its children in bn are sorted
+        children = dict((node, 0) for node in bn)
+        for node in bn:
+            for parent in node.parents["list"]:
+                if parent in children:
+                    children[parent] += 1
+
+        # the leaves are taken in the order of bn, a node that becomes a
+        #leaf before the last one taken waiting for the next round, so the
+        #order is the one of going through bn again and again
+        current = [position[node] for node in bn if not children[node]]
+        following = []
+
+        while current:
+            node = bn[heapq.heappop(current)]
+            lsorted.append(node)
+
+            for parent in node.parents["list"]:
+                if parent not in children:
+                    continue
+                children[parent] -= 1
+                if not children[parent]:
+                    if position[parent] > position[node]:
+                        heapq.heappush(current, position[parent])
+                    else:
+                        following.append(position[parent])
+
+            if not current:
+                (current, following) = (following, [])
+                heapq.heapify(current)
 
         return lsorted
 
@@ -144,92 +831,29 @@ class VE(object):
             e: Evidence to be removed from variable
 
         Returns:
-            The Node without the evidence
+            The factor of the node without the evidence
         """
 
-        # return variable
-        res_table = []
-        res_table_header = list(variable.table_header)
-        changed = False
-
-        # makes a list of the variables of the table
-        remind = []
-        for i in range(len(variable.table_header)):
-            if variable.table_header[i] in e:
-                remind.append(i)
-                changed = True
-
-        if changed:
-            remind.sort()
-            remind.reverse()
-
-            for j in variable.table:
-                good = True
-                for k in remind:
-                    if e[variable.table_header[k]] != j[k]:
-                        good = False
-                        break
-                if good:
-                    res_table.append(j)
-                    for i in remind:
-                        res_table[-1].pop(i)
-
-        if changed:
-            variable.table = res_table
-            variable.table_header = res_table_header
-            for i in remind:
-                variable.table_header.pop(i)
-
-        return variable
+        return variable.factor.restrict(e)
 
     @staticmethod
     def sum_out(variable, PwP):
-        """ Removes the column of the given variable, and sums the \
-            probabilities of the common remaining lines.
+        """ Removes the axis of the given variable, summing the \
+            probabilities along it.
 
         Arguments:
             variable: Variable to remove
-            factors: Node on which to perform the removal
+            PwP: Factor on which to perform the removal
 
         Returns:
-            The new node containing the table without the variable.
+            The new factor without the variable.
         """
 
-        new_var = Variable()
-        new_var.table_header = list(PwP.table_header)
-        new_var.table_header.remove(variable)
-        new_var.table = []
-        checked = [False for i in range(len(PwP.table))]
-
-        # index of the variable to skip
-        askip = PwP.table_header.index(variable)
-
-        for i in range(len(PwP.table)):
-            summed = 0
-            # skips the already checked
-            if not checked[i]:
-                for j in range(i, len(PwP.table)):
-                    if (not checked[j]):
-                        toappend = []
-                        flag = True
-                        for a in range(len(PwP.table_header)):
-                            if a == askip:
-                                continue
-                            elif (PwP.table[i][a] != PwP.table[j][a]):
-                                flag = False
-                                break
-                            else:
-                                toappend.append(PwP.table[i][a])
-                        if flag:
-                            summed += PwP.table[j][-1]
-                            checked[j] = True
-                toappend = []
-                for j in range(len(PwP.table_header)):
-                    if (PwP.table_header[j] != variable):
-                        toappend.append(PwP.table[i][j])
-                toappend.append(summed)
-                new_var.table.append(toappend)
-        return [new_var]
+        table_header = list(PwP.table_header)
+        axis = table_header.index(variable)
+        table_header.remove(variable)
+
+        return [Factor(table_header, PwP.values.sum(axis=axis))]
 
     @staticmethod
     def normalize(variable):
@@ -237,103 +861,67 @@ class VE(object):
             product operation.
 
         Arguments:
-            variable: The variable containing the CPT to normalize
+            variable: The factor to normalize
 
         Returns:
-            The normalized matrix (the sum of all probabilities is 1)
+            The normalized factor (the sum of all probabilities is 1)
         """
 
-        PwPsum = 0
-
-        for line in variable.table:
-            PwPsum += line[-1]
-
-        for i in range(len(variable.table)):
-            variable.table[i][-1] = variable.table[i][-1]/PwPsum
-
-        return variable
+        return Factor(variable.table_header,
+                      variable.values / variable.values.sum())
 
     @staticmethod
     def pointwise_product(factors):
-        """ Performs the pointwise product between all the nodes in the \
+        """ Performs the pointwise product between all the factors in the \
             factors list
 
         Arguments:
-            factors: The several nodes on which to perform the product
+            factors: The several factors on which to perform the product
 
         """
 
         if len(factors) == 1:
             return factors[0]
 
-        new_var = Variable()
+        return VE.join(factors)
+
+    @staticmethod
+    def sum_product(variable, factors):
+        """ Performs the pointwise product between all the factors and \
+            sums out the given variable in a single pass, without building \
+            the whole product.
+
+        Arguments:
+            variable: Variable to remove
+            factors: The several factors on which to perform the product
+
+        Returns:
+            The new factor without the variable.
+        """
 
+        return [VE.join(factors, variable)]
+
+    @staticmethod
+    def join(factors, summed=None):
+        """ Joins the factors on their common variables
+
+        Arguments:
+            factors: The several factors to join
+            summed: Optional variable to sum out of the result
+
+        Returns:
+            The factor with the product of all the factors
+        """
+
+        # the variables of the first factor followed by the ones that
+        #only show up in the following factors
+        table_header = []
         for f in factors:
-            if not new_var.table_header:
-                new_var.table_header = f.table_header
-                new_var.table = f.table
-                continue
-            else:
-                common = set(new_var.table_header) & set(f.table_header)
-                # get their indexes in the res
-                new_varindex = [new_var.table_header.index(k) for k in common]
-                findex = []
-
-                # get their indexes in the new factor
-                for i in new_varindex:
-                    findex.append(
-                        f.table_header.index(new_var.table_header[i])
-                    )
-
-                # New table_header with all the variables
-                newtable_header = []
-                # the common variables
-                for i in range(len(common)):
-                    newtable_header.append(
-                        new_var.table_header[new_varindex[i]]
-                    )
-                # the variables only in the new_var factor
-                for i in range(len(new_var.table_header)):
-                    if new_var.table_header[i] not in common:
-                        newtable_header.append(new_var.table_header[i])
-                # the variables only in the new factor
-                for i in range(len(f.table_header)):
-                    if f.table_header[i] not in common:
-                        newtable_header.append(f.table_header[i])
-
-                # create and fill the new table
-                newtable = []
-
-                # for each line of the new_var factor
-                for l in new_var.table:
-                    # and for each line of the new factor
-                    for t in f.table:
-                        same = True
-                        # if it's common skip
-                        for i in range(len(common)):
-                            if t[findex[i]] != l[new_varindex[i]]:
-                                same = False
-                                break
-                        # if it has the same common var values
-                        if same:
-                            toappend = []
-                            # values of the common variables
-                            for i in range(len(common)):
-                                toappend.append(t[findex[i]])
-                            # values of the variables in the existing table
-                            for i in range(len(new_var.table_header)):
-                                if new_var.table_header[i] not in common:
-                                    toappend.append(l[i])
-                            # values in the new table
-                            for i in range(len(f.table_header)):
-                                if f.table_header[i] not in common:
-                                    toappend.append(t[i])
-                            toappend.append(t[-1]*l[-1])
-                            newtable.append(toappend)
-
-                # set the newly calculated table as the new_var table
-                new_var.table = newtable
-                # set the newly calculated header as the res header
-                new_var.table_header = newtable_header
-
-        return new_var
+            for var in f.table_header:
+                if var not in table_header:
+                    table_header.append(var)
+
+        if summed is not None:
+            table_header.remove(summed)
+
+        return Factor.product(factors, table_header)
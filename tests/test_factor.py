@@ -0,0 +1,66 @@
+""" Tests of the products of many factors
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from bayes import BayesN, Variable
+from factor import Factor
+from qe import QandE
+from ve import VE
+
+
+class TestManyFactors(unittest.TestCase):
+    """ Products of more factors than numpy.einsum takes at once
+    """
+
+    def test_product(self):
+        var = Variable({"name": "C", "values": ["t", "f"]})
+        other = Variable({"name": "D", "values": ["t", "f"]})
+        factors = [Factor([var], [0.5, 0.25]) for i in range(70)]
+        factors.append(Factor([var, other], [[1.0, 2.0], [3.0, 4.0]]))
+
+        result = Factor.product(factors, [other])
+
+        expected = (0.5 ** 70 * numpy.array([1.0, 2.0]) +
+                    0.25 ** 70 * numpy.array([3.0, 4.0]))
+        numpy.testing.assert_allclose(result.values, expected)
+
+    def test_naive_bayes(self):
+        # class C with 70 children, all of them evidence
+        lines = ["VAR\nname C\nvalues t f\n"]
+        for i in range(70):
+            lines.append("VAR\nname X{}\nparents C\nvalues t f\n".format(i))
+        lines.append("CPT\nvar C\ntable t 0.3 f 0.7\n")
+        for i in range(70):
+            lines.append("CPT\nvar X{}\ntable t t 0.6 t f 0.5 f t 0.4 "
+                         "f f 0.5\n".format(i))
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "naive.bn")
+            with open(filename, 'w') as bn_file:
+                bn_file.write("\n".join(lines))
+            bn = BayesN(filename)
+
+        qe = QandE()
+        qe.parse_line(["QUERY", "C"])
+        evidence = ["EVIDENCE", "70"]
+        for i in range(70):
+            evidence += ["X{}".format(i), "t"]
+        qe.parse_line(evidence)
+
+        result = VE(bn.nodes, qe, False).result
+
+        expected = numpy.array([0.3 * 0.6 ** 70, 0.7 * 0.5 ** 70])
+        numpy.testing.assert_allclose(result.values,
+                                      expected / expected.sum())
+
+
+if __name__ == '__main__':
+    unittest.main()